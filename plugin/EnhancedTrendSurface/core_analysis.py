@@ -4,14 +4,123 @@ Core trend surface analysis functionality
 """
 
 import numpy as np
+from functools import lru_cache
+from math import comb
+from scipy.linalg import cho_factor, cho_solve
 from qgis.core import (QgsVectorLayer, QgsRasterLayer, QgsProject, 
                        QgsCoordinateReferenceSystem, QgsFields, QgsField, 
-                       QgsFeature, QgsGeometry, QgsPointXY)
+                       QgsFeature, QgsFeatureSink, QgsGeometry, QgsPointXY)
 from osgeo import gdal, osr
 import tempfile
 import os
+import time
 from qgis.PyQt.QtCore import QVariant
 
+# Tiled, float-predictor DEFLATE output; blocks match the 512x512 evaluation tiles
+GTIFF_OPTIONS = ['TILED=YES', 'BLOCKXSIZE=512', 'BLOCKYSIZE=512',
+                 'COMPRESS=DEFLATE', 'PREDICTOR=3', 'ZLEVEL=1', 'NUM_THREADS=ALL_CPUS']
+
+@lru_cache(maxsize=None)
+def _term_table(degree):
+    """Exponents (x_exp, y_exp) of each coefficient, in x^(d-j) * y^j order"""
+    x_exp = np.array([d - j for d in range(degree + 1) for j in range(d + 1)], dtype=np.int64)
+    y_exp = np.array([j for d in range(degree + 1) for j in range(d + 1)], dtype=np.int64)
+    # Shared between callers through the cache, so keep them read-only
+    x_exp.setflags(write=False)
+    y_exp.setflags(write=False)
+    return x_exp, y_exp
+
+
+try:
+    from numba import njit, prange
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+
+
+if HAS_NUMBA:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _eval_grid(coeffs, degree, xmin, ymax, dx, dy, rows, cols, out):
+        """Evaluate the trend polynomial for every cell, rows in parallel"""
+        for row in prange(rows):
+            y = ymax - row * dy
+            
+            # Along a row the surface is a polynomial in x whose coefficients
+            # are polynomials in y; evaluate those once per row by Horner
+            px = np.empty(degree + 1)
+            for i in range(degree + 1):
+                inner = 0.0
+                for j in range(degree - i, -1, -1):
+                    inner = inner * y + coeffs[i + j, j]
+                px[i] = inner
+            
+            for col in range(cols):
+                x = xmin + col * dx
+                value = px[degree]
+                for i in range(degree - 1, -1, -1):
+                    value = value * x + px[i]
+                out[row, col] = value
+    
+    @njit(cache=True)
+    def _monomials(x, y, degree, xp, yp, out):
+        """Fill out with the design-matrix row x^(d-j) * y^j of one point"""
+        xp[0] = 1.0
+        yp[0] = 1.0
+        for k in range(1, degree + 1):
+            xp[k] = xp[k - 1] * x
+            yp[k] = yp[k - 1] * y
+        idx = 0
+        for d in range(degree + 1):
+            for j in range(d + 1):
+                out[idx] = xp[d - j] * yp[j]
+                idx += 1
+    
+    @njit(cache=True)
+    def _regress_core(x, y, z, degree):
+        """Normal-equations fit without forming A: Gram matrix, Cholesky solve and residuals"""
+        n = x.shape[0]
+        n_terms = (degree + 1) * (degree + 2) // 2
+        xp = np.empty(degree + 1)
+        yp = np.empty(degree + 1)
+        m = np.empty(n_terms)
+        
+        # Accumulate the lower triangle of A^T A and A^T z point by point
+        ATA = np.zeros((n_terms, n_terms))
+        ATz = np.zeros(n_terms)
+        for k in range(n):
+            _monomials(x[k], y[k], degree, xp, yp, m)
+            for p in range(n_terms):
+                ATz[p] += m[p] * z[k]
+                for q in range(p + 1):
+                    ATA[p, q] += m[p] * m[q]
+        for p in range(n_terms):
+            for q in range(p):
+                ATA[q, p] = ATA[p, q]
+        
+        # Unit-norm column scaling, then Cholesky and two triangular solves
+        scale = np.sqrt(np.diag(ATA))
+        for p in range(n_terms):
+            if scale[p] == 0:
+                scale[p] = 1.0
+        L = np.linalg.cholesky(ATA / np.outer(scale, scale))
+        w = ATz / scale
+        for i in range(n_terms):
+            for k in range(i):
+                w[i] -= L[i, k] * w[k]
+            w[i] /= L[i, i]
+        for i in range(n_terms - 1, -1, -1):
+            for k in range(i + 1, n_terms):
+                w[i] -= L[k, i] * w[k]
+            w[i] /= L[i, i]
+        coefficients = w / scale
+        
+        residuals = np.empty(n)
+        for k in range(n):
+            _monomials(x[k], y[k], degree, xp, yp, m)
+            residuals[k] = z[k] - np.dot(m, coefficients)
+        
+        return coefficients, residuals
+
 
 class TrendSurfaceAnalyzer:
     """Core trend surface analysis engine"""
@@ -31,39 +140,34 @@ class TrendSurfaceAnalyzer:
         try:
             self.log("Starting trend surface analysis...")
             
-            # Collect data
-            points, z_values = self.collect_point_data(input_layer, z_field)
+            # Collect data straight into coordinate arrays
+            x, y, z, features = self.collect_point_data(input_layer, z_field)
             
-            if len(points) < 3:
+            if len(x) < 3:
                 raise Exception("Insufficient points for analysis")
             
-            # Convert to arrays
-            x = np.array([p[0] for p in points])
-            y = np.array([p[1] for p in points])
-            z = np.array(z_values)
-            
-            self.log(f"Processing {len(points)} points...")
+            self.log(f"Processing {len(x)} points...")
             
-            # Create design matrix
-            A = self.create_design_matrix(x, y, polynomial_degree)
-            
-            # Perform regression
-            coefficients, residuals = self.polynomial_regression(A, z)
+            # Perform regression; the design matrix is built in chunks and never held whole
+            coefficients, residuals, normalization = self.polynomial_regression(x, y, z, polynomial_degree)
             
             # Calculate statistics
-            z_pred = A @ coefficients
-            r2 = self.calculate_r2(z, z_pred)
+            z_pred = z - residuals
+            r2 = self.calculate_r2(z, residuals)
             
             self.log(f"Analysis complete - R²: {r2:.4f}")
             
             return {
                 'coefficients': coefficients,
                 'residuals': residuals,
-                'points': points,
+                'x': x,
+                'y': y,
                 'z_original': z,
                 'z_predicted': z_pred,
                 'r2': r2,
-                'degree': polynomial_degree
+                'degree': polynomial_degree,
+                'normalization': normalization,
+                'features': features
             }
             
         except Exception as e:
@@ -71,78 +175,147 @@ class TrendSurfaceAnalyzer:
             raise
     
     def collect_point_data(self, layer, z_field):
-        """Collect point coordinates and Z values"""
-        points = []
-        z_values = []
+        """Collect point coordinates and Z values as separate NumPy arrays"""
+        total_features = layer.featureCount()
+        x = np.empty(max(total_features, 0))
+        y = np.empty_like(x)
+        z = np.empty_like(x)
+        n = 0
+        
+        # Features are kept so the residual layer does not read the provider again
+        features = []
         
         for feature in layer.getFeatures():
+            features.append(feature)
             geometry = feature.geometry()
             z_value = feature[z_field]
+            parts = geometry.asMultiPoint() if geometry.isMultipart() else [geometry.asPoint()]
             
-            if geometry.isMultipart():
-                for point in geometry.asMultiPoint():
-                    points.append((point.x(), point.y()))
-                    z_values.append(z_value)
-            else:
-                point = geometry.asPoint()
-                points.append((point.x(), point.y()))
-                z_values.append(z_value)
+            for point in parts:
+                if n == len(x):
+                    # Multipart features hold more points than the feature count
+                    x, y, z = (np.resize(a, 2 * n + 1) for a in (x, y, z))
+                x[n] = point.x()
+                y[n] = point.y()
+                z[n] = z_value
+                n += 1
         
-        return points, z_values
+        return x[:n], y[:n], z[:n], features
     
     def create_design_matrix(self, x, y, degree):
         """Create polynomial design matrix"""
-        n_points = len(x)
-        n_terms = (degree + 1) * (degree + 2) // 2
+        x_exp, y_exp = _term_table(degree)
         
-        A = np.ones((n_points, n_terms))
+        # Powers 0..degree of each coordinate, computed once and gathered per term
+        X = np.vander(x, degree + 1, increasing=True)
+        Y = np.vander(y, degree + 1, increasing=True)
+        return X[:, x_exp] * Y[:, y_exp]
+    
+    def design_chunks(self, x, y, degree, chunk_size=65536):
+        """Yield (slice, design matrix block) pairs over consecutive chunks of points"""
+        for start in range(0, len(x), chunk_size):
+            rows = slice(start, min(start + chunk_size, len(x)))
+            yield rows, self.create_design_matrix(x[rows], y[rows], degree)
+    
+    def polynomial_regression(self, x, y, z, degree):
+        """Least squares fit in centered, scaled coordinates: coefficients, residuals, (xc, yc, sx, sy)"""
+        coefficients = None
+        residuals = None
         
-        col_index = 0
-        for d in range(degree + 1):
-            for j in range(d + 1):
-                if col_index < n_terms:
-                    A[:, col_index] = (x ** (d - j)) * (y ** j)
-                    col_index += 1
+        # Solve on centered and scaled coordinates: squared northings alone reach
+        # 1e13, and monomials of raw map coordinates leave the normal matrix with
+        # no digits to spare. The coefficients stay in this basis; converting them
+        # back to map-coordinate monomials would cancel just as badly
+        xc, yc = x.mean(), y.mean()
+        sx = x.std() or 1.0
+        sy = y.std() or 1.0
+        u = (x - xc) / sx
+        v = (y - yc) / sy
+        
+        # Normal equations square the condition number of A, so the solution
+        # carries an error of order kappa(A)^2 * eps instead of kappa(A) * eps.
+        # Monomial designs of degree 3 and up are ill-conditioned enough for
+        # this to matter; solve those by QR on A instead.
+        if degree < 3:
+            try:
+                if HAS_NUMBA:
+                    # Fused compiled kernel: no design matrix is formed at all
+                    coefficients, residuals = _regress_core(u, v, z, degree)
+                else:
+                    coefficients = self.solve_normal_equations(u, v, z, degree)
+            except np.linalg.LinAlgError:
+                # Not positive definite: fall back to the QR solve
+                coefficients = None
+                residuals = None
+        
+        if coefficients is None:
+            coefficients = self.solve_qr(u, v, z, degree)
+        
+        # Calculate residuals
+        if residuals is None:
+            residuals = np.empty_like(z)
+            for rows, A_chunk in self.design_chunks(u, v, degree):
+                residuals[rows] = z[rows] - A_chunk @ coefficients
         
-        return A
+        return coefficients, residuals, (xc, yc, sx, sy)
     
-    def polynomial_regression(self, A, z):
-        """Perform polynomial regression using least squares"""
-        try:
-            # Solve using normal equations: (A^T A)^-1 A^T z
-            ATA = A.T @ A
-            ATz = A.T @ z
-            coefficients = np.linalg.solve(ATA, ATz)
-            
-            # Calculate residuals
-            residuals = z - (A @ coefficients)
-            
-            return coefficients, residuals
-            
-        except np.linalg.LinAlgError:
-            # Fallback to pseudo-inverse if matrix is singular
-            coefficients = np.linalg.pinv(A) @ z
-            residuals = z - (A @ coefficients)
-            return coefficients, residuals
-    
-    def calculate_r2(self, z_obs, z_pred):
-        """Calculate R-squared value"""
-        ss_res = np.sum((z_obs - z_pred) ** 2)
-        ss_tot = np.sum((z_obs - np.mean(z_obs)) ** 2)
+    def solve_normal_equations(self, x, y, z, degree):
+        """Solve (A^T A) c = A^T z with A^T A accumulated chunk by chunk"""
+        n_terms = len(_term_table(degree)[0])
+        ATA = np.zeros((n_terms, n_terms))
+        ATz = np.zeros(n_terms)
+        for rows, A_chunk in self.design_chunks(x, y, degree):
+            ATA += A_chunk.T @ A_chunk
+            ATz += A_chunk.T @ z[rows]
+        
+        # Scale columns to unit norm; monomial columns span many orders of
+        # magnitude and this shrinks cond(A) at no cost to the solution
+        scale = np.sqrt(np.diag(ATA))
+        scale[scale == 0] = 1
+        
+        # A^T A is symmetric positive definite, so factor it with Cholesky
+        c, low = cho_factor(ATA / np.outer(scale, scale), check_finite=False)
+        return cho_solve((c, low), ATz / scale, check_finite=False) / scale
+    
+    def solve_qr(self, x, y, z, degree):
+        """Least squares through a QR factorization of A updated chunk by chunk"""
+        n_terms = len(_term_table(degree)[0])
+        R = np.zeros((0, n_terms))
+        Qtz = np.zeros(0)
+        for rows, A_chunk in self.design_chunks(x, y, degree):
+            Q, R = np.linalg.qr(np.vstack([R, A_chunk]))
+            Qtz = Q.T @ np.concatenate([Qtz, z[rows]])
+        
+        # min ||Ac - z|| equals min ||Rc - Q^T z||; solve the small system with
+        # SVD-based lstsq on unit-norm columns so rank deficiency is still handled
+        scale = np.linalg.norm(R, axis=0)
+        scale[scale == 0] = 1
+        return np.linalg.lstsq(R / scale, Qtz, rcond=None)[0] / scale
+    
+    def calculate_r2(self, z_obs, residuals):
+        """Calculate R-squared value from the observations and regression residuals"""
+        ss_res = np.dot(residuals, residuals)
+        ss_tot = z_obs.var() * z_obs.size
         return 1 - (ss_res / ss_tot) if ss_tot != 0 else 0
     
     def create_trend_surface(self, analysis_result, extent, cell_size, crs, output_path):
         """Create trend surface raster"""
+        # Give GDAL's block cache room for large rasters while this one is written,
+        # without shrinking a larger setting; the process-wide value is restored after
+        previous_cache = gdal.GetCacheMax()
         try:
+            if previous_cache < 1 << 30:
+                gdal.SetCacheMax(1 << 30)
+            
             self.log("Creating trend surface raster...")
+            start_time = time.perf_counter()
             
             # Determine extent from points if not provided
             if extent is None:
-                points = analysis_result['points']
-                x_coords = [p[0] for p in points]
-                y_coords = [p[1] for p in points]
-                xmin, xmax = min(x_coords), max(x_coords)
-                ymin, ymax = min(y_coords), max(y_coords)
+                x_coords = analysis_result['x']
+                y_coords = analysis_result['y']
+                xmin, xmax = float(x_coords.min()), float(x_coords.max())
+                ymin, ymax = float(y_coords.min()), float(y_coords.max())
                 # Add 10% buffer
                 x_buffer = (xmax - xmin) * 0.1
                 y_buffer = (ymax - ymin) * 0.1
@@ -160,47 +333,103 @@ class TrendSurfaceAnalyzer:
             
             self.log(f"Raster dimensions: {cols} x {rows}")
             
-            # Create raster data
-            trend_data = np.zeros((rows, cols), dtype=np.float32)
+            # Evaluate and write the raster tile by tile to bound peak memory
             coefficients = analysis_result['coefficients']
             degree = analysis_result['degree']
+            xc, yc, sx, sy = analysis_result['normalization']
+            table = self.coefficient_table(coefficients, degree)
+            tile_size = 512
+            
+            out_raster = self.create_raster(output_path, cols, rows, xmin, ymax, cell_size, crs)
+            band = out_raster.GetRasterBand(1)
             
-            for row in range(rows):
-                if row % 100 == 0:
-                    self.log(f"Processing row {row}/{rows}")
-                
-                y_val = ymax - row * cell_size
-                for col in range(cols):
-                    x_val = xmin + col * cell_size
-                    trend_data[row, col] = self.evaluate_polynomial(x_val, y_val, coefficients, degree)
+            for row_start in range(0, rows, tile_size):
+                tile_rows = min(tile_size, rows - row_start)
+                tile_ymax = ymax - row_start * cell_size
+                for col_start in range(0, cols, tile_size):
+                    tile_cols = min(tile_size, cols - col_start)
+                    tile_xmin = xmin + col_start * cell_size
+                    # Tile corner and cell steps in the fit's normalized units
+                    tile = self.evaluate_tile(table, degree, (tile_xmin - xc) / sx, (tile_ymax - yc) / sy,
+                                              cell_size / sx, cell_size / sy, tile_rows, tile_cols)
+                    band.WriteArray(tile, col_start, row_start)
             
-            # Save raster
-            self.save_raster(output_path, trend_data, xmin, ymax, cell_size, crs)
-            self.log(f"Trend surface saved: {output_path}")
+            band.FlushCache()
+            out_raster = None
+            # One summary line instead of progress messages from inside the tile loop
+            self.log(f"Trend surface saved: {output_path} ({time.perf_counter() - start_time:.1f} s)")
             
             return output_path
             
         except Exception as e:
             self.log(f"Error creating trend surface: {str(e)}")
             raise
+        finally:
+            gdal.SetCacheMax(previous_cache)
     
-    def evaluate_polynomial(self, x, y, coefficients, degree):
-        """Evaluate polynomial at given coordinates"""
-        value = 0
-        idx = 0
+    def evaluate_tile(self, table, degree, u0, v0, du, dv, rows, cols):
+        """Evaluate the polynomial on a block of cells from its top-left cell (u0, v0) and steps du, dv, in fit units"""
+        # Re-expand around the tile corner in float64, in the fit's normalized units.
+        # The tile then spans at most a few of those units, so both the local
+        # coefficients and the offsets stay moderate. The float32 Horner error is then
+        # about 1e-7 relative to the sum of the term magnitudes, not to the value
+        # itself; on raw map coordinates these terms would be far too large for float32
+        local = self.shift_table(table, degree, u0, v0)
+        
+        if HAS_NUMBA:
+            tile = np.empty((rows, cols), dtype=np.float32)
+            _eval_grid(local, degree, 0.0, 0.0, float(du), float(dv), rows, cols, tile)
+            return tile
+        
+        local = local.astype(np.float32)
+        u_vec = np.arange(cols, dtype=np.float32) * np.float32(du)
+        v_vec = np.arange(rows, dtype=np.float32) * np.float32(-dv)
+        
+        # Horner in x across the block, with per-row coefficients from Horner in y
+        px = self.x_coefficients(local, degree, v_vec)
+        tile = np.empty((rows, cols), dtype=np.float32)
+        tile[:] = px[degree][:, None]
+        for i in range(degree - 1, -1, -1):
+            tile *= u_vec
+            tile += px[i][:, None]
+        return tile
+    
+    def shift_table(self, table, degree, x0, y0):
+        """Coefficient table of the same polynomial in local coordinates (x - x0, y - y0)"""
+        local = np.zeros_like(table)
         for d in range(degree + 1):
             for j in range(d + 1):
-                if idx < len(coefficients):
-                    value += coefficients[idx] * (x ** (d - j)) * (y ** j)
-                    idx += 1
-        return value
+                i = d - j
+                # Binomial expansion of (u + x0)^i * (v + y0)^j
+                for a in range(i + 1):
+                    for b in range(j + 1):
+                        local[a + b, b] += (table[d, j] * comb(i, a) * comb(j, b)
+                                            * x0 ** (i - a) * y0 ** (j - b))
+        return local
+    
+    def coefficient_table(self, coefficients, degree):
+        """Pack coefficients into a lower-triangular table indexed [d, j] for term x^(d-j) * y^j"""
+        x_exp, y_exp = _term_table(degree)
+        n = min(len(coefficients), len(x_exp))
+        table = np.zeros((degree + 1, degree + 1))
+        table[x_exp[:n] + y_exp[:n], y_exp[:n]] = coefficients[:n]
+        return table
+    
+    def x_coefficients(self, table, degree, y):
+        """Coefficients of the polynomial in x at ordinate y (scalar or array), each by Horner in y"""
+        px = []
+        for i in range(degree + 1):
+            inner = 0.0
+            for j in range(degree - i, -1, -1):
+                inner = inner * y + table[i + j, j]
+            px.append(inner)
+        return px
     
-    def save_raster(self, path, data, xmin, ymax, cell_size, crs):
-        """Save data to raster file"""
+    def create_raster(self, path, cols, rows, xmin, ymax, cell_size, crs):
+        """Create an empty single band float raster for incremental writing"""
         driver = gdal.GetDriverByName('GTiff')
-        rows, cols = data.shape
         
-        out_raster = driver.Create(path, cols, rows, 1, gdal.GDT_Float32)
+        out_raster = driver.Create(path, cols, rows, 1, gdal.GDT_Float32, options=GTIFF_OPTIONS)
         out_raster.SetGeoTransform((xmin, cell_size, 0, ymax, 0, -cell_size))
         
         if crs.isValid():
@@ -208,14 +437,15 @@ class TrendSurfaceAnalyzer:
             srs.ImportFromWkt(crs.toWkt())
             out_raster.SetProjection(srs.ExportToWkt())
         
-        band = out_raster.GetRasterBand(1)
-        band.WriteArray(data)
-        band.SetNoDataValue(-9999)
-        band.FlushCache()
-        out_raster = None
+        out_raster.GetRasterBand(1).SetNoDataValue(-9999)
+        return out_raster
     
-    def create_residual_layer(self, input_layer, residuals, z_field):
+    def create_residual_layer(self, input_layer, residuals, z_field, features=None):
         """Create a point layer with residuals"""
+        # Reuse the features cached by analyze; read the layer only if none are given
+        if features is None:
+            features = input_layer.getFeatures()
+        
         residual_layer = QgsVectorLayer("Point?crs=" + input_layer.sourceCrs().authid(), 
                                       "Residual Points", "memory")
         provider = residual_layer.dataProvider()
@@ -227,28 +457,30 @@ class TrendSurfaceAnalyzer:
         provider.addAttributes(fields)
         residual_layer.updateFields()
         
+        # Field lookups resolved once, outside the feature loop
+        n_input_fields = input_layer.fields().count()
+        z_idx = input_layer.fields().indexOf(z_field)
+        output_fields = residual_layer.fields()
+        
         # Add features with residuals
-        features = []
-        for i, (feature, residual) in enumerate(zip(input_layer.getFeatures(), residuals)):
-            if i >= len(residuals):
-                break
-                
-            new_feature = QgsFeature(residual_layer.fields())
+        new_features = []
+        for feature, residual in zip(features, residuals):
+            new_feature = QgsFeature(output_fields)
             new_feature.setGeometry(feature.geometry())
             
-            # Copy attributes
-            attributes = feature.attributes()
-            for j in range(min(len(attributes), input_layer.fields().count())):
-                new_feature.setAttribute(j, attributes[j])
+            # Copy attributes, padded to the input field count
+            attributes = feature.attributes()[:n_input_fields]
+            attributes += [None] * (n_input_fields - len(attributes))
             
-            # Add residual and predicted values
-            z_value = feature[z_field] if feature[z_field] is not None else 0
-            new_feature.setAttribute(input_layer.fields().count(), float(residual))
-            new_feature.setAttribute(input_layer.fields().count() + 1, float(z_value - residual))
+            # Add residual and predicted values, all attributes set in one call
+            z_value = feature[z_idx]
+            if z_value is None:
+                z_value = 0
+            new_feature.setAttributes(attributes + [float(residual), float(z_value - residual)])
             
-            features.append(new_feature)
+            new_features.append(new_feature)
         
-        provider.addFeatures(features)
+        provider.addFeatures(new_features, QgsFeatureSink.FastInsert)
         residual_layer.updateExtents()
         
         return residual_layer
\ No newline at end of file
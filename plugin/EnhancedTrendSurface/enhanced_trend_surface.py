@@ -228,7 +228,8 @@ class EnhancedTrendSurfacePlugin:
             
             # Create residual layer
             residual_layer = analyzer.create_residual_layer(
-                input_layer, analysis_result['residuals'], z_field
+                input_layer, analysis_result['residuals'], z_field,
+                analysis_result['features']
             )
             QgsProject.instance().addMapLayer(residual_layer)
             
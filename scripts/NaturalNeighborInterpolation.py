@@ -0,0 +1,448 @@
+"""
+Algorithm: Natural Neighbor Interpolation
+Provider: Custom
+"""
+
+from qgis.core import (QgsProcessing,
+                       QgsProcessingAlgorithm,
+                       QgsProcessingParameterFeatureSource,
+                       QgsProcessingParameterField,
+                       QgsProcessingParameterNumber,
+                       QgsProcessingParameterExtent,
+                       QgsProcessingParameterEnum,
+                       QgsProcessingParameterRasterDestination,
+                       QgsProcessingException,
+                       QgsFeatureRequest)
+import numpy as np
+from osgeo import gdal, osr
+from scipy.spatial import Delaunay
+from scipy.interpolate import LinearNDInterpolator, CloughTocher2DInterpolator
+
+try:
+    from numba import njit, prange
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+    prange = range
+
+    def njit(*args, **kwargs):
+        """Run the kernels as plain Python when Numba is not installed"""
+        return lambda func: func
+
+
+# Capacity of the per-cell Bowyer-Watson cavity; larger cavities are left as NoData
+MAX_CAVITY = 256
+
+
+@njit(cache=True)
+def _circumcenter(ax, ay, bx, by, cx, cy):
+    """Circumcenter of triangle (a, b, c); NaN when the points are collinear"""
+    d = 2.0 * (ax * (by - cy) + bx * (cy - ay) + cx * (ay - by))
+    if abs(d) < 1e-300:
+        return np.nan, np.nan
+    a2 = ax * ax + ay * ay
+    b2 = bx * bx + by * by
+    c2 = cx * cx + cy * cy
+    ux = (a2 * (by - cy) + b2 * (cy - ay) + c2 * (ay - by)) / d
+    uy = (a2 * (cx - bx) + b2 * (ax - cx) + c2 * (bx - ax)) / d
+    return ux, uy
+
+
+@njit(cache=True)
+def _convex_area(px, py, n):
+    """Shoelace area of the convex polygon through the first n points, in any order"""
+    mx = 0.0
+    my = 0.0
+    for i in range(n):
+        mx += px[i]
+        my += py[i]
+    mx /= n
+    my /= n
+    angles = np.empty(n)
+    for i in range(n):
+        angles[i] = np.arctan2(py[i] - my, px[i] - mx)
+    order = np.argsort(angles)
+    area = 0.0
+    for i in range(n):
+        a = order[i]
+        b = order[(i + 1) % n]
+        area += px[a] * py[b] - px[b] * py[a]
+    return 0.5 * abs(area)
+
+
+@njit(parallel=True, cache=True)
+def _sibson_grid(out, xs, ys, start, points, values, simplices, neighbors, centers, radii2, nodata):
+    """Sibson natural neighbor interpolation of every grid cell, rows in parallel"""
+    rows, cols = out.shape
+    for row in prange(rows):
+        qy = ys[row]
+        cavity = np.empty(MAX_CAVITY, np.int64)
+        edge_a = np.empty(MAX_CAVITY + 2, np.int64)
+        edge_b = np.empty(MAX_CAVITY + 2, np.int64)
+        ring = np.empty(MAX_CAVITY + 2, np.int64)
+        px = np.empty(MAX_CAVITY + 2)
+        py = np.empty(MAX_CAVITY + 2)
+
+        for col in range(cols):
+            qx = xs[col]
+            out[row, col] = nodata
+            s = start[row, col]
+            if s < 0:
+                continue
+
+            # Query point on top of a data point takes its value
+            hit = -1
+            for k in range(3):
+                v = simplices[s, k]
+                if (points[v, 0] - qx) ** 2 + (points[v, 1] - qy) ** 2 < 1e-20:
+                    hit = v
+            if hit >= 0:
+                out[row, col] = values[hit]
+                continue
+
+            # Bowyer-Watson cavity: triangles whose circumcircle contains the query point
+            cavity[0] = s
+            n_cav = 1
+            head = 0
+            overflow = False
+            while head < n_cav:
+                t = cavity[head]
+                head += 1
+                for k in range(3):
+                    nb = neighbors[t, k]
+                    if nb < 0:
+                        continue
+                    seen = False
+                    for m in range(n_cav):
+                        if cavity[m] == nb:
+                            seen = True
+                            break
+                    if seen:
+                        continue
+                    if (centers[nb, 0] - qx) ** 2 + (centers[nb, 1] - qy) ** 2 < radii2[nb]:
+                        if n_cav == MAX_CAVITY:
+                            overflow = True
+                            break
+                        cavity[n_cav] = nb
+                        n_cav += 1
+                if overflow:
+                    break
+            if overflow:
+                continue
+
+            # Boundary edges of the cavity, oriented counter-clockwise around it
+            n_edges = 0
+            for m in range(n_cav):
+                t = cavity[m]
+                for k in range(3):
+                    nb = neighbors[t, k]
+                    inside = False
+                    if nb >= 0:
+                        for mm in range(n_cav):
+                            if cavity[mm] == nb:
+                                inside = True
+                                break
+                    if inside:
+                        continue
+                    a = simplices[t, (k + 1) % 3]
+                    b = simplices[t, (k + 2) % 3]
+                    c = simplices[t, k]
+                    cross = ((points[b, 0] - points[a, 0]) * (points[c, 1] - points[a, 1])
+                             - (points[b, 1] - points[a, 1]) * (points[c, 0] - points[a, 0]))
+                    if cross < 0:
+                        a, b = b, a
+                    edge_a[n_edges] = a
+                    edge_b[n_edges] = b
+                    n_edges += 1
+
+            # Chain the edges into a ring of natural neighbors
+            ring[0] = edge_a[0]
+            current = edge_b[0]
+            closed = True
+            for i in range(1, n_edges):
+                ring[i] = current
+                found = False
+                for e in range(n_edges):
+                    if edge_a[e] == current:
+                        current = edge_b[e]
+                        found = True
+                        break
+                if not found:
+                    closed = False
+                    break
+            if not closed:
+                continue
+
+            # Area each natural neighbor loses to the query point's new Voronoi cell
+            total_area = 0.0
+            total_value = 0.0
+            degenerate = False
+            for i in range(n_edges):
+                p1 = ring[(i - 1) % n_edges]
+                p2 = ring[i]
+                p3 = ring[(i + 1) % n_edges]
+                c1x, c1y = _circumcenter(qx, qy, points[p1, 0], points[p1, 1], points[p2, 0], points[p2, 1])
+                c2x, c2y = _circumcenter(qx, qy, points[p2, 0], points[p2, 1], points[p3, 0], points[p3, 1])
+                if np.isnan(c1x) or np.isnan(c2x):
+                    degenerate = True
+                    break
+                px[0] = c1x
+                py[0] = c1y
+                px[1] = c2x
+                py[1] = c2y
+                n_poly = 2
+                for m in range(n_cav):
+                    t = cavity[m]
+                    if simplices[t, 0] == p2 or simplices[t, 1] == p2 or simplices[t, 2] == p2:
+                        px[n_poly] = centers[t, 0]
+                        py[n_poly] = centers[t, 1]
+                        n_poly += 1
+                area = _convex_area(px, py, n_poly)
+                total_area += area
+                total_value += area * values[p2]
+            if degenerate or total_area <= 0.0:
+                continue
+
+            out[row, col] = total_value / total_area
+
+
+class NaturalNeighborInterpolation(QgsProcessingAlgorithm):
+    """
+    Algoritmo de interpolação por vizinhos naturais a partir de pontos
+    """
+
+    # Constants
+    INPUT = 'INPUT'
+    Z_FIELD = 'Z_FIELD'
+    METHOD = 'METHOD'
+    CELL_SIZE = 'CELL_SIZE'
+    EXTENT = 'EXTENT'
+    OUTPUT = 'OUTPUT'
+
+    NODATA = -9999
+
+    def initAlgorithm(self, config=None):
+        # Input points
+        self.addParameter(
+            QgsProcessingParameterFeatureSource(
+                self.INPUT,
+                'Camada de pontos de entrada',
+                [QgsProcessing.TypeVectorPoint]
+            )
+        )
+
+        # Campo Z
+        self.addParameter(
+            QgsProcessingParameterField(
+                self.Z_FIELD,
+                'Campo Z (valor)',
+                type=QgsProcessingParameterField.Numeric,
+                parentLayerParameterName=self.INPUT,
+                allowMultiple=False
+            )
+        )
+
+        # Método de interpolação
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                self.METHOD,
+                'Método de interpolação',
+                options=['Vizinhos naturais (Sibson)', 'Linear', 'Clough-Tocher (suave)'],
+                defaultValue=0
+            )
+        )
+
+        # Tamanho da célula
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.CELL_SIZE,
+                'Tamanho da célula',
+                type=QgsProcessingParameterNumber.Double,
+                minValue=0.1,
+                defaultValue=100.0
+            )
+        )
+
+        # Extensão
+        self.addParameter(
+            QgsProcessingParameterExtent(
+                self.EXTENT,
+                'Extensão da saída',
+                optional=True
+            )
+        )
+
+        # Output
+        self.addParameter(
+            QgsProcessingParameterRasterDestination(
+                self.OUTPUT,
+                'Raster interpolado'
+            )
+        )
+
+    def processAlgorithm(self, parameters, context, feedback):
+        # Get parameters
+        source = self.parameterAsSource(parameters, self.INPUT, context)
+        z_field = self.parameterAsString(parameters, self.Z_FIELD, context)
+        method = self.parameterAsInt(parameters, self.METHOD, context)
+        cell_size = self.parameterAsDouble(parameters, self.CELL_SIZE, context)
+        extent = self.parameterAsExtent(parameters, self.EXTENT, context)
+        output_path = self.parameterAsOutputLayer(parameters, self.OUTPUT, context)
+
+        if source is None:
+            raise QgsProcessingException(self.invalidSourceError(parameters, self.INPUT))
+
+        # Step 1: Collect points straight into coordinate arrays
+        feedback.pushInfo("Coletando pontos...")
+        x, y, z = self.collect_points(source, z_field, feedback)
+
+        if len(x) < 3:
+            raise QgsProcessingException("Número insuficiente de pontos para interpolação")
+
+        feedback.pushInfo(f"Pontos coletados: {len(x)}")
+
+        # Step 2: Triangulate once, in coordinates centered on the data for precision
+        feedback.pushInfo("Construindo triangulação de Delaunay...")
+        x0 = np.mean(x)
+        y0 = np.mean(y)
+        try:
+            tri = Delaunay(np.column_stack([x - x0, y - y0]))
+        except Exception as e:
+            raise QgsProcessingException(f"Erro na triangulação: {str(e)}")
+
+        # Step 3: Define output grid
+        if extent.isNull():
+            xmin, xmax = np.min(x), np.max(x)
+            ymin, ymax = np.min(y), np.max(y)
+        else:
+            xmin, xmax = extent.xMinimum(), extent.xMaximum()
+            ymin, ymax = extent.yMinimum(), extent.yMaximum()
+
+        cols = max(1, int((xmax - xmin) / cell_size) + 1)
+        rows = max(1, int((ymax - ymin) / cell_size) + 1)
+
+        feedback.pushInfo(f"Dimensões do raster: {cols} x {rows}")
+        feedback.setProgress(40)
+
+        # Step 4: Evaluate on the whole grid
+        feedback.pushInfo("Interpolando valores na grade...")
+        xs = xmin - x0 + np.arange(cols) * cell_size
+        ys = ymax - y0 - np.arange(rows) * cell_size
+        X, Y = np.meshgrid(xs, ys)
+
+        if method == 0:
+            if not HAS_NUMBA:
+                feedback.pushWarning("Numba não encontrado: a interpolação por vizinhos naturais será executada em Python puro (lenta)")
+
+            # Enclosing triangle of every cell in one vectorized Qhull query
+            start = tri.find_simplex(np.column_stack([X.ravel(), Y.ravel()])).reshape(X.shape)
+            centers, radii2 = self.circumcircles(tri)
+            raster_data = np.empty((rows, cols))
+            _sibson_grid(raster_data, xs, ys, start, tri.points, z, tri.simplices,
+                         tri.neighbors, centers, radii2, float(self.NODATA))
+            raster_data = raster_data.astype(np.float32)
+        elif method == 1:
+            interpolator = LinearNDInterpolator(tri, z, fill_value=self.NODATA)
+            raster_data = interpolator(X, Y).astype(np.float32)
+        else:
+            interpolator = CloughTocher2DInterpolator(tri, z, fill_value=self.NODATA)
+            raster_data = interpolator(X, Y).astype(np.float32)
+
+        feedback.setProgress(90)
+
+        # Step 5: Write raster
+        self.save_raster(output_path, raster_data, xmin, ymax, cell_size, source.sourceCrs())
+
+        feedback.setProgress(100)
+        feedback.pushInfo("Interpolação concluída!")
+        return {self.OUTPUT: output_path}
+
+    def collect_points(self, source, z_field, feedback):
+        """
+        Collect point coordinates and Z values as separate NumPy arrays
+        """
+        total_features = source.featureCount()
+        x = np.empty(max(total_features, 0))
+        y = np.empty_like(x)
+        z = np.empty_like(x)
+        n = 0
+
+        # Only the Z attribute is needed; resolve its index once
+        z_idx = source.fields().indexOf(z_field)
+        request = QgsFeatureRequest().setSubsetOfAttributes([z_idx])
+
+        for i, feature in enumerate(source.getFeatures(request)):
+            if feedback.isCanceled():
+                break
+
+            if i % 100 == 0 and total_features > 0:
+                feedback.setProgress(int(i / total_features * 30))
+
+            z_value = feature.attribute(z_idx)
+            if z_value is None:
+                continue
+
+            geometry = feature.geometry()
+            parts = geometry.asMultiPoint() if geometry.isMultipart() else [geometry.asPoint()]
+            for point in parts:
+                if n == len(x):
+                    # Multipart features hold more points than the feature count
+                    x, y, z = (np.resize(a, 2 * n + 1) for a in (x, y, z))
+                x[n] = point.x()
+                y[n] = point.y()
+                z[n] = z_value
+                n += 1
+
+        return x[:n], y[:n], z[:n]
+
+    def circumcircles(self, tri):
+        """
+        Circumcenters and squared circumradii of all Delaunay triangles
+        """
+        a = tri.points[tri.simplices[:, 0]]
+        b = tri.points[tri.simplices[:, 1]]
+        c = tri.points[tri.simplices[:, 2]]
+        d = 2.0 * (a[:, 0] * (b[:, 1] - c[:, 1]) + b[:, 0] * (c[:, 1] - a[:, 1]) + c[:, 0] * (a[:, 1] - b[:, 1]))
+        a2 = np.sum(a ** 2, axis=1)
+        b2 = np.sum(b ** 2, axis=1)
+        c2 = np.sum(c ** 2, axis=1)
+        ux = (a2 * (b[:, 1] - c[:, 1]) + b2 * (c[:, 1] - a[:, 1]) + c2 * (a[:, 1] - b[:, 1])) / d
+        uy = (a2 * (c[:, 0] - b[:, 0]) + b2 * (a[:, 0] - c[:, 0]) + c2 * (b[:, 0] - a[:, 0])) / d
+        centers = np.column_stack([ux, uy])
+        radii2 = np.sum((a - centers) ** 2, axis=1)
+        return centers, radii2
+
+    def save_raster(self, path, data, xmin, ymax, cell_size, crs):
+        """
+        Save a single band float raster with the grid geotransform
+        """
+        rows, cols = data.shape
+        driver = gdal.GetDriverByName('GTiff')
+        out_raster = driver.Create(path, cols, rows, 1, gdal.GDT_Float32)
+        out_raster.SetGeoTransform((xmin, cell_size, 0, ymax, 0, -cell_size))
+
+        if crs.isValid():
+            srs = osr.SpatialReference()
+            srs.ImportFromWkt(crs.toWkt())
+            out_raster.SetProjection(srs.ExportToWkt())
+
+        band = out_raster.GetRasterBand(1)
+        band.SetNoDataValue(self.NODATA)
+        band.WriteArray(data)
+        band.FlushCache()
+        out_raster = None
+
+    def name(self):
+        return 'naturalneighborinterpolation'
+
+    def displayName(self):
+        return 'Interpolação por Vizinhos Naturais'
+
+    def group(self):
+        return 'Custom'
+
+    def groupId(self):
+        return 'custom'
+
+    def createInstance(self):
+        return NaturalNeighborInterpolation()
@@ -3,7 +3,8 @@ Algorithm: Smooth Contours from Raster
 Provider: Custom
 """
 
-from qgis.core import (QgsProcessing,
+from qgis.core import (Qgis,
+                       QgsProcessing,
                        QgsProcessingAlgorithm,
                        QgsProcessingParameterRasterLayer,
                        QgsProcessingParameterNumber,
@@ -11,18 +12,24 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterBoolean,
                        QgsProcessingParameterEnum,
                        QgsRasterLayer,
+                       QgsRasterBandStats,
                        QgsVectorLayer,
                        QgsGeometry,
                        QgsFeature,
+                       QgsFeatureSink,
                        QgsField,
                        QgsFields,
-                       QgsWkbTypes)
+                       QgsWkbTypes,
+                       QgsProcessingException)
 from qgis.PyQt.QtCore import QVariant
 import processing
 import numpy as np
+from osgeo import gdal
 from scipy import ndimage
 import tempfile
 import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 
 class SmoothContoursFromRaster(QgsProcessingAlgorithm):
     """
@@ -109,61 +116,41 @@ class SmoothContoursFromRaster(QgsProcessingAlgorithm):
 
         feedback.pushInfo("Iniciando extração de contornos suaves...")
 
-        # Step 1: Get raster statistics to determine contour range
-        band_stats = raster_layer.dataProvider().bandStatistics(1)
+        # Step 1: Get raster statistics to determine contour range; only min/max are scanned
+        provider = raster_layer.dataProvider()
+        band_stats = provider.bandStatistics(1, QgsRasterBandStats.Min | QgsRasterBandStats.Max)
+        nodata_value = provider.sourceNoDataValue(1) if provider.sourceHasNoDataValue(1) else None
         min_val = band_stats.minimumValue
         max_val = band_stats.maximumValue
         
-        # Calculate contour levels
-        contour_levels = []
-        current_level = min_val + (interval - (min_val % interval)) if min_val % interval != 0 else min_val
-        while current_level <= max_val:
-            contour_levels.append(current_level)
-            current_level += interval
+        # Calculate contour levels as multiples of the interval (no accumulated drift)
+        start = np.ceil(min_val / interval) * interval
+        contour_levels = start + interval * np.arange(np.floor((max_val - start) / interval) + 1)
 
         feedback.pushInfo(f"Gerando {len(contour_levels)} níveis de contorno de {min_val} a {max_val}")
 
-        # Step 2: Create temporary smoothed raster
+        # Step 2: Apply smoothing in memory and write a single smoothed raster
         feedback.pushInfo("Aplicando suavização no raster...")
-        
-        # Export raster to temporary file for processing
-        temp_raster = os.path.join(tempfile.gettempdir(), 'temp_raster.tif')
-        processing.run("gdal:translate", {
-            'INPUT': raster_layer,
-            'TARGET_CRS': raster_layer.crs(),
-            'OUTPUT': temp_raster
-        }, context=context, feedback=feedback)
-
-        # Step 3: Apply smoothing using GDAL
         smoothed_raster = os.path.join(tempfile.gettempdir(), 'smoothed_raster.tif')
-        
-        if smooth_method == 0:  # Gaussian
-            processing.run("gdal:fillnodata", {
-                'INPUT': temp_raster,
-                'BAND': 1,
-                'DISTANCE': 10,
-                'ITERATIONS': smooth_iterations,
-                'OUTPUT': smoothed_raster
-            }, context=context, feedback=feedback)
-        elif smooth_method == 1:  # Median
-            processing.run("gdal:sievecallback", {
-                'INPUT': temp_raster,
-                'BAND': 1,
-                'MASK': None,
-                'COMPUTE_EDGES': True,
-                'LEVEL': smooth_iterations,
-                'OUTPUT': smoothed_raster
-            }, context=context, feedback=feedback)
-        else:  # Mean
-            processing.run("gdal:fillnodata", {
-                'INPUT': temp_raster,
-                'BAND': 1,
-                'DISTANCE': 5 * smooth_iterations,
-                'ITERATIONS': 1,
-                'OUTPUT': smoothed_raster
-            }, context=context, feedback=feedback)
-
-        # Step 4: Generate contours from smoothed raster
+
+        # Read the band once through the provider, already decoded by QGIS
+        raster_data, geotransform = self.read_band_array(provider)
+
+        smoothed_data = self.smooth_raster_array(raster_data, nodata_value, smooth_method, smooth_iterations)
+
+        rows, cols = smoothed_data.shape
+        driver = gdal.GetDriverByName('GTiff')
+        out_raster = driver.Create(smoothed_raster, cols, rows, 1, gdal.GDT_Float32)
+        out_raster.SetGeoTransform(geotransform)
+        out_raster.SetProjection(raster_layer.crs().toWkt())
+        out_band = out_raster.GetRasterBand(1)
+        if nodata_value is not None:
+            out_band.SetNoDataValue(nodata_value)
+        out_band.WriteArray(smoothed_data)
+        out_band.FlushCache()
+        out_raster = None
+
+        # Step 3: Generate contours from smoothed raster
         feedback.pushInfo("Gerando contornos do raster suavizado...")
         
         temp_contours = os.path.join(tempfile.gettempdir(), 'temp_contours.gpkg')
@@ -175,13 +162,13 @@ class SmoothContoursFromRaster(QgsProcessingAlgorithm):
             'FIELD_NAME': 'ELEV',
             'CREATE_3D': False,
             'IGNORE_NODATA': True,
-            'NODATA': band_stats.noDataValue if band_stats.noDataValue else -9999,
+            'NODATA': nodata_value if nodata_value is not None else -9999,
             'OFFSET': 0,
             'EXTRA': '',
             'OUTPUT': temp_contours
         }, context=context, feedback=feedback)
 
-        # Step 5: Load contours and apply additional smoothing
+        # Step 4: Load contours and apply additional smoothing
         contours_layer = QgsVectorLayer(temp_contours, 'temp_contours', 'ogr')
         
         if not contours_layer.isValid():
@@ -211,33 +198,47 @@ class SmoothContoursFromRaster(QgsProcessingAlgorithm):
         total_features = contours_layer.featureCount()
         feedback.pushInfo(f"Aplicando suavização final em {total_features} feições...")
 
-        for current, feature in enumerate(contours_layer.getFeatures()):
-            if feedback.isCanceled():
-                break
-
-            geometry = feature.geometry()
-            if not geometry.isEmpty():
-                # Smooth the geometry
-                smoothed_geometry = self.smooth_geometry(geometry, smooth_iterations)
-                
-                # Simplify if tolerance is specified
-                if simplify_tolerance > 0:
-                    smoothed_geometry = smoothed_geometry.simplify(simplify_tolerance)
-                
-                # Create new feature
-                new_feature = QgsFeature(fields)
-                new_feature.setGeometry(smoothed_geometry)
-                new_feature.setAttribute("id", current)
-                new_feature.setAttribute("elevation", feature.attribute("ELEV"))
-                new_feature.setAttribute("original_id", feature.id())
-                
-                sink.addFeature(new_feature, QgsFeatureSink.FastInsert)
-
-            feedback.setProgress(int(current * total_features))
+        # Features are independent, so smooth them on a thread pool; the sink is
+        # not thread-safe and is only written from this thread
+        features = list(contours_layer.getFeatures())
+        smooth_one = partial(self._smooth_one,
+                             iterations=smooth_iterations,
+                             simplify_tolerance=simplify_tolerance)
+
+        # Features are handed to the sink in batches to limit Python/C++ crossings
+        batch = []
+        batch_size = 1000
+
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+            for current, result in enumerate(executor.map(smooth_one, features)):
+                if feedback.isCanceled():
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    break
+
+                if result is not None:
+                    elevation, original_id, smoothed_geometry = result
+
+                    # Create new feature
+                    new_feature = QgsFeature(fields)
+                    new_feature.setGeometry(smoothed_geometry)
+                    new_feature.setAttribute("id", current)
+                    new_feature.setAttribute("elevation", elevation)
+                    new_feature.setAttribute("original_id", original_id)
+                    
+                    batch.append(new_feature)
+                    if len(batch) >= batch_size:
+                        sink.addFeatures(batch, QgsFeatureSink.FastInsert)
+                        batch.clear()
+
+                # Percentage, throttled to about a hundred updates
+                if total_features and current % max(1, total_features // 100) == 0:
+                    feedback.setProgress(int(100 * current / total_features))
+
+        if batch:
+            sink.addFeatures(batch, QgsFeatureSink.FastInsert)
 
         # Clean up temporary files
         try:
-            os.remove(temp_raster)
             os.remove(smoothed_raster)
             os.remove(temp_contours)
         except:
@@ -246,53 +247,84 @@ class SmoothContoursFromRaster(QgsProcessingAlgorithm):
         feedback.pushInfo("Processamento concluído!")
         return {self.OUTPUT: dest_id}
 
-    def smooth_geometry(self, geometry, iterations):
+    def read_band_array(self, provider):
         """
-        Apply smoothing to a geometry using Chaikin's algorithm
+        Read band 1 of a raster provider as a float64 array, with its geotransform
         """
-        if geometry.isMultipart():
-            parts = geometry.asMultiPolyline()
-            smoothed_parts = []
-            for part in parts:
-                smoothed_part = self.chaikin_smooth(part, iterations)
-                smoothed_parts.append(smoothed_part)
-            return QgsGeometry.fromMultiPolylineXY(smoothed_parts)
-        else:
-            line = geometry.asPolyline()
-            smoothed_line = self.chaikin_smooth(line, iterations)
-            return QgsGeometry.fromPolylineXY(smoothed_line)
-
-    def chaikin_smooth(self, line, iterations):
+        dtypes = {
+            Qgis.Byte: np.uint8,
+            Qgis.UInt16: np.uint16,
+            Qgis.Int16: np.int16,
+            Qgis.UInt32: np.uint32,
+            Qgis.Int32: np.int32,
+            Qgis.Float32: np.float32,
+            Qgis.Float64: np.float64,
+        }
+        dtype = dtypes.get(provider.dataType(1))
+        if dtype is None:
+            raise QgsProcessingException("Tipo de dado do raster não suportado")
+
+        extent = provider.extent()
+        width = provider.xSize()
+        height = provider.ySize()
+        block = provider.block(1, extent, width, height)
+        if not block.isValid():
+            raise QgsProcessingException("Não foi possível ler o raster de entrada")
+
+        data = np.frombuffer(block.data(), dtype=dtype).reshape(height, width).astype(np.float64)
+        geotransform = (extent.xMinimum(), extent.width() / width, 0,
+                        extent.yMaximum(), 0, -extent.height() / height)
+        return data, geotransform
+
+    def smooth_raster_array(self, data, nodata_value, method, strength):
         """
-        Chaikin's smoothing algorithm for lines
+        Smooth a raster array with scipy.ndimage, keeping NoData cells untouched
         """
-        if len(line) < 3:
-            return line
-
-        smoothed = line
-        for _ in range(iterations):
-            new_line = [smoothed[0]]  # Keep first point
-            for i in range(len(smoothed) - 1):
-                p0 = smoothed[i]
-                p1 = smoothed[i + 1]
-                
-                # Calculate quarter points
-                q0 = QgsPointXY(
-                    p0.x() * 0.75 + p1.x() * 0.25,
-                    p0.y() * 0.75 + p1.y() * 0.25
-                )
-                q1 = QgsPointXY(
-                    p0.x() * 0.25 + p1.x() * 0.75,
-                    p0.y() * 0.25 + p1.y() * 0.75
-                )
-                
-                new_line.extend([q0, q1])
-            
-            new_line.append(smoothed[-1])  # Keep last point
-            smoothed = new_line
-        
+        valid = ~np.isnan(data)
+        if nodata_value is not None:
+            valid &= data != nodata_value
+        if not valid.any():
+            return data
+
+        # Fill NoData with the nearest valid value so it does not bleed into the filter
+        filled = data
+        if not valid.all():
+            indices = ndimage.distance_transform_edt(~valid, return_distances=False, return_indices=True)
+            filled = data[tuple(indices)]
+
+        if method == 0:  # Gaussian
+            smoothed = ndimage.gaussian_filter(filled, sigma=strength)
+        elif method == 1:  # Median
+            smoothed = ndimage.median_filter(filled, size=2 * strength + 1)
+        else:  # Mean
+            smoothed = ndimage.uniform_filter(filled, size=2 * strength + 1)
+
+        smoothed[~valid] = nodata_value if nodata_value is not None else np.nan
         return smoothed
 
+    def _smooth_one(self, feature, iterations, simplify_tolerance):
+        """
+        Smooth and simplify one contour feature; safe to call from worker threads
+        """
+        geometry = feature.geometry()
+        if geometry.isEmpty():
+            return None
+
+        # Smooth the geometry
+        smoothed_geometry = self.smooth_geometry(geometry, iterations)
+
+        # Simplify if tolerance is specified
+        if simplify_tolerance > 0:
+            smoothed_geometry = smoothed_geometry.simplify(simplify_tolerance)
+
+        return feature.attribute("ELEV"), feature.id(), smoothed_geometry
+
+    def smooth_geometry(self, geometry, iterations):
+        """
+        Apply Chaikin smoothing to a geometry using the native QGIS implementation
+        """
+        return geometry.smooth(iterations, 0.25)
+
     def name(self):
         return 'smoothcontoursfromraster'
 
@@ -13,15 +13,75 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterNumber,
                        QgsProcessingParameterExtent,
                        QgsProcessingUtils,
-                       QgsFields, QgsField, QgsFeature,
+                       QgsFields, QgsField, QgsFeature, QgsFeatureRequest,
                        QgsGeometry, QgsPointXY,
                        QgsRasterLayer, QgsCoordinateReferenceSystem,
                        QgsProcessingException)
 import numpy as np
+from scipy.linalg import cho_factor, cho_solve, lstsq
 from osgeo import gdal, osr
 import tempfile
 import os
 
+try:
+    from numba import njit, prange
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+
+try:
+    import numexpr
+    HAS_NUMEXPR = True
+except ImportError:
+    HAS_NUMEXPR = False
+
+
+if HAS_NUMBA:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _fill_trend(raster_data, x0, y0, dx, dy, C):
+        """Avalia o polinômio de tendência em cada célula, com linhas em paralelo
+
+        A célula (row, col) fica nas coordenadas normalizadas (x0 + col * dx, y0 - row * dy);
+        C[i, j] é o coeficiente de x**i * y**j.
+        """
+        rows, cols = raster_data.shape
+        degree = C.shape[0] - 1
+
+        for row in prange(rows):
+            y_val = y0 - row * dy
+
+            # y é constante ao longo da linha: Horner em y fornece um coeficiente por potência de x
+            row_coefficients = np.empty(degree + 1)
+            for i in range(degree + 1):
+                acc = C[i, degree - i]
+                for j in range(degree - i - 1, -1, -1):
+                    acc = acc * y_val + C[i, j]
+                row_coefficients[i] = acc
+
+            # Horner em x: degree multiplicações-somas por célula
+            for col in range(cols):
+                x_val = x0 + col * dx
+                value = row_coefficients[degree]
+                for i in range(degree - 1, -1, -1):
+                    value = value * x_val + row_coefficients[i]
+                raster_data[row, col] = value
+
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _build_design(x, y, degree, out):
+        """Preenche a matriz de design (N, T) no próprio array, um ponto por iteração"""
+        for i in prange(x.shape[0]):
+            out[i, 0] = 1.0
+            prev = 0
+            cur = 1
+            for d in range(1, degree + 1):
+                # Termos de grau d a partir do grau d - 1: x**(d-j) * y**j é x vezes o
+                # anterior x**(d-1-j) * y**j, e o termo puro y**d é y * y**(d-1)
+                for j in range(d):
+                    out[i, cur + j] = out[i, prev + j] * x[i]
+                out[i, cur + d] = out[i, prev + d - 1] * y[i]
+                prev = cur
+                cur += d + 1
+
 
 class TrendSurfaceAlgorithm(QgsProcessingAlgorithm):
     """
@@ -109,43 +169,55 @@ class TrendSurfaceAlgorithm(QgsProcessingAlgorithm):
         if source is None:
             raise QgsProcessingException(self.invalidSourceError(parameters, self.INPUT))
 
-        # Coletar pontos e valores
-        points = []
-        z_values = []
+        # Coletar pontos e valores diretamente em arrays de coordenadas
         total_features = source.featureCount()
+        x = np.empty(max(total_features, 0))
+        y = np.empty_like(x)
+        z = np.empty_like(x)
+        n = 0
+
+        # Apenas o atributo Z é necessário; resolver seu índice uma única vez
+        z_idx = source.fields().indexOf(z_field)
+        request = QgsFeatureRequest().setSubsetOfAttributes([z_idx])
         
         feedback.pushInfo(f"Coletando {total_features} pontos...")
 
-        for i, feature in enumerate(source.getFeatures()):
-            if feedback.isCanceled():
-                break
-                
+        for i, feature in enumerate(source.getFeatures(request)):
+            # Cancelamento e progresso passam pelo Qt; consultá-los apenas a cada 100 feições
             if i % 100 == 0:
+                if feedback.isCanceled():
+                    break
                 feedback.setProgress(int(i / total_features * 50))
                 
+            # Valores NULL não cabem nos arrays float; ignorar esses pontos
+            z_value = feature.attribute(z_idx)
+            if z_value is None:
+                continue
+
             geometry = feature.geometry()
-            if geometry.isMultipart():
-                points.extend([p for p in geometry.asMultiPoint()])
-                z_values.extend([feature[z_field]] * len(geometry.asMultiPoint()))
-            else:
-                point = geometry.asPoint()
-                points.append((point.x(), point.y()))
-                z_values.append(feature[z_field])
-
-        if len(points) < 3:
+            parts = geometry.asMultiPoint() if geometry.isMultipart() else [geometry.asPoint()]
+            for point in parts:
+                if n == len(x):
+                    # Feições multiparte contêm mais pontos que a contagem de feições
+                    x, y, z = (np.resize(a, 2 * n + 1) for a in (x, y, z))
+                x[n] = point.x()
+                y[n] = point.y()
+                z[n] = z_value
+                n += 1
+
+        if n < 3:
             raise QgsProcessingException("Número insuficiente de pontos para gerar superfície de tendência")
 
-        # Converter para arrays numpy
-        x = np.array([p[0] for p in points])
-        y = np.array([p[1] for p in points])
-        z = np.array(z_values)
+        x = x[:n]
+        y = y[:n]
+        z = z[:n]
 
-        feedback.pushInfo(f"Pontos coletados: {len(points)}")
+        feedback.pushInfo(f"Pontos coletados: {n}")
         feedback.pushInfo(f"Ajustando polinômio de grau {polynomial_degree}...")
 
         # Ajustar superfície de tendência polinomial
         try:
-            coefficients = self.fit_polynomial_surface(x, y, z, polynomial_degree, feedback)
+            coefficients, terms, xc, yc, sx, sy = self.fit_polynomial_surface(x, y, z, polynomial_degree, feedback)
         except Exception as e:
             raise QgsProcessingException(f"Erro no ajuste polinomial: {str(e)}")
 
@@ -164,9 +236,12 @@ class TrendSurfaceAlgorithm(QgsProcessingAlgorithm):
         feedback.pushInfo(f"Dimensões do raster: {cols} x {rows}")
         feedback.pushInfo(f"Extensão: X({xmin:.2f}, {xmax:.2f}) Y({ymin:.2f}, {ymax:.2f})")
 
-        # Criar raster
+        # Criar raster, em blocos de 256 x 256 para casar com a gravação por blocos abaixo
+        block = 256
         driver = gdal.GetDriverByName('GTiff')
-        out_raster = driver.Create(output_path, cols, rows, 1, gdal.GDT_Float32)
+        out_raster = driver.Create(output_path, cols, rows, 1, gdal.GDT_Float32,
+                                   options=['TILED=YES', f'BLOCKXSIZE={block}', f'BLOCKYSIZE={block}',
+                                            'COMPRESS=LZW', 'PREDICTOR=3', 'BIGTIFF=IF_SAFER'])
         
         # Definir transformação geográfica
         geotransform = (xmin, cell_size, 0, ymax, 0, -cell_size)
@@ -186,22 +261,37 @@ class TrendSurfaceAlgorithm(QgsProcessingAlgorithm):
         feedback.setProgress(60)
         feedback.pushInfo("Gerando raster de superfície de tendência...")
 
-        # Calcular valores para cada célula
-        raster_data = np.zeros((rows, cols), dtype=np.float32)
-        
-        for row in range(rows):
+        # Avaliar e gravar o raster um bloco do arquivo por vez: cada bloco calculado é exatamente
+        # um bloco de 256 x 256, então o GDAL o comprime direto, sem buffer intermediário,
+        # e o acumulador float64 de um bloco permanece no cache
+        tile = np.empty((min(block, rows), min(block, cols)), dtype=np.float32)
+
+        # Coeficientes organizados uma única vez para os avaliadores, C[i, j] multiplica x**i * y**j
+        C = self.coefficient_matrix(coefficients, terms)
+
+        # O polinômio é avaliado nas mesmas coordenadas normalizadas usadas no ajuste
+        xs = (xmin + np.arange(cols) * cell_size - xc) / sx
+
+        for row_start in range(0, rows, block):
             if feedback.isCanceled():
                 break
-                
-            if row % 100 == 0:
-                feedback.setProgress(60 + int(row / rows * 35))
-                
-            y_val = ymax - row * cell_size
-            for col in range(cols):
-                x_val = xmin + col * cell_size
-                raster_data[row, col] = self.evaluate_polynomial(x_val, y_val, coefficients, polynomial_degree)
 
-        band.WriteArray(raster_data)
+            rs = min(block, rows - row_start)
+            tile_top = ymax - row_start * cell_size
+            ys = (tile_top - np.arange(rs) * cell_size - yc) / sy
+
+            for col_start in range(0, cols, block):
+                cs = min(block, cols - col_start)
+                if HAS_NUMBA:
+                    _fill_trend(tile[:rs, :cs], xs[col_start], ys[0],
+                                cell_size / sx, cell_size / sy, C)
+                else:
+                    tile[:rs, :cs] = self.evaluate_polynomial_grid(xs[col_start:col_start + cs], ys, C)
+
+                band.WriteArray(tile[:rs, :cs], col_start, row_start)
+
+            feedback.setProgress(60 + int((row_start + rs) / rows * 35))
+
         band.FlushCache()
         
         out_raster = None  # Fechar arquivo
@@ -212,34 +302,119 @@ class TrendSurfaceAlgorithm(QgsProcessingAlgorithm):
         return {self.OUTPUT: output_path}
 
     def fit_polynomial_surface(self, x, y, z, degree, feedback):
-        """Ajusta uma superfície polinomial aos pontos"""
-        # Criar matriz de design
-        A = []
-        for i in range(len(x)):
-            row = []
-            for d in range(degree + 1):
-                for j in range(d + 1):
-                    row.append(x[i] ** (d - j) * y[i] ** j)
-            A.append(row)
-        
-        A = np.array(A)
-        
-        # Resolver sistema linear usando mínimos quadrados
-        coefficients, residuals, rank, s = np.linalg.lstsq(A, z, rcond=None)
-        
-        feedback.pushInfo(f"Resíduos do ajuste: {residuals[0]:.4f}" if len(residuals) > 0 else "Ajuste concluído")
+        """Ajusta uma superfície polinomial aos pontos
+
+        Retorna os coeficientes com os expoentes de seus termos e a centralização
+        (xc, yc) e a escala (sx, sy) a que se referem: o polinômio é em
+        ((x - xc) / sx, (y - yc) / sy).
+        """
+        terms = self.term_exponents(degree)
+
+        # Centralizar e escalar as coordenadas; coordenadas de mapa brutas elevadas ao
+        # grau do polinômio tornam a matriz de design irremediavelmente mal condicionada
+        xc = x.mean()
+        yc = y.mean()
+        sx = x.std() or 1.0
+        sy = y.std() or 1.0
+        # float32 basta para a matriz de design depois de normalizar as coordenadas
+        # e reduz à metade o tráfego de memória; z continua em float64
+        x = ((x - xc) / sx).astype(np.float32)
+        y = ((y - yc) / sy).astype(np.float32)
+
+        # Criar matriz de design, uma coluna por termo x**(d-j) * y**j
+        if HAS_NUMBA:
+            A = np.empty((len(x), len(terms)), dtype=np.float32)
+            _build_design(x, y, degree, A)
+        else:
+            # Tabelas de potências por ponto; vander as monta por produtos acumulados em vez de pow()
+            xp = np.vander(x, degree + 1, increasing=True)
+            yp = np.vander(y, degree + 1, increasing=True)
+            A = xp[:, terms[:, 0]] * yp[:, terms[:, 1]]
+
+        # Acumular as equações normais em float64, convertendo um bloco de linhas por vez
+        n_terms = A.shape[1]
+        AtA = np.zeros((n_terms, n_terms))
+        Atz = np.zeros(n_terms)
+        block_rows = 65536
+        for start in range(0, len(z), block_rows):
+            block = A[start:start + block_rows].astype(np.float64)
+            AtA += block.T @ block
+            Atz += block.T @ z[start:start + block_rows]
+
+        # Escalar colunas para norma unitária; colunas de monômios abrangem muitas ordens de grandeza.
+        # As normas são a raiz da diagonal da matriz normal
+        scale = np.sqrt(np.diag(AtA))
+        scale[scale == 0] = 1
+
+        # Resolver as equações normais por Cholesky: apenas um pequeno sistema T x T para qualquer
+        # número de pontos
+        try:
+            c, low = cho_factor(AtA / np.outer(scale, scale), check_finite=False)
+            coefficients = cho_solve((c, low), Atz / scale, check_finite=False) / scale
+        except np.linalg.LinAlgError:
+            # Não positiva definida (termos quase colineares): recorrer a mínimos quadrados,
+            # por QR com pivoteamento de colunas (gelsy) em vez do driver SVD mais lento do NumPy
+            coefficients = lstsq(A / scale, z, lapack_driver='gelsy', check_finite=False)[0] / scale
+
+        rss = 0.0
+        for start in range(0, len(z), block_rows):
+            residuals = z[start:start + block_rows] - A[start:start + block_rows].astype(np.float64) @ coefficients
+            rss += np.dot(residuals, residuals)
+        feedback.pushInfo(f"Resíduos do ajuste: {rss:.4f}")
         
-        return coefficients
-
-    def evaluate_polynomial(self, x, y, coefficients, degree):
-        """Avalia o polinômio nas coordenadas x, y"""
-        value = 0
-        idx = 0
-        for d in range(degree + 1):
-            for j in range(d + 1):
-                value += coefficients[idx] * (x ** (d - j)) * (y ** j)
-                idx += 1
-        return value
+        return coefficients, terms, xc, yc, sx, sy
+
+    def term_exponents(self, degree):
+        """Expoentes (de x, de y) de cada termo, na ordem (d, j) dos coeficientes"""
+        return np.array([(d - j, j) for d in range(degree + 1) for j in range(d + 1)], dtype=np.int8)
+
+    def coefficient_matrix(self, coefficients, terms):
+        """Matriz triangular superior de coeficientes, C[i, j] multiplica x**i * y**j"""
+        degree = int(terms.max())
+        C = np.zeros((degree + 1, degree + 1))
+        C[terms[:, 0], terms[:, 1]] = coefficients
+        return C
+
+    def trend_expression(self, C):
+        """Forma de Horner aninhada do polinômio ajustado em x e y, com os coeficientes como literais"""
+        degree = C.shape[0] - 1
+
+        # Coeficiente de x**i como polinômio de Horner em y, depois Horner em x sobre eles
+        x_terms = []
+        for i in range(degree + 1):
+            term = repr(float(C[i, degree - i]))
+            for j in range(degree - i - 1, -1, -1):
+                term = f"({term}) * y + ({float(C[i, j])!r})"
+            x_terms.append(term)
+        expression = x_terms[degree]
+        for i in range(degree - 1, -1, -1):
+            expression = f"({expression}) * x + ({x_terms[i]})"
+        return expression
+
+    def evaluate_polynomial_grid(self, xs, ys, C):
+        """Avalia o polinômio na grade definida pelas coordenadas de colunas xs e de linhas ys"""
+        if HAS_NUMEXPR:
+            # Uma única passada fundida e multithread sobre a grade para toda a expressão desenrolada
+            return numexpr.evaluate(self.trend_expression(C),
+                                    local_dict={'x': xs[None, :], 'y': ys[:, None]})
+
+        degree = C.shape[0] - 1
+
+        # Horner em y reduz cada potência de x a um coeficiente 1-D ao longo das linhas
+        row_coefficients = []
+        for i in range(degree + 1):
+            acc = np.full(len(ys), C[i, degree - i])
+            for j in range(degree - i - 1, -1, -1):
+                acc = acc * ys + C[i, j]
+            row_coefficients.append(acc)
+
+        # Horner em x sobre toda a grade, atualizado no próprio array
+        values = np.empty((len(ys), len(xs)))
+        values[:] = row_coefficients[degree][:, None]
+        for i in range(degree - 1, -1, -1):
+            values *= xs[None, :]
+            values += row_coefficients[i][:, None]
+        return values
 
     def name(self):
         return 'trendsurface'
@@ -13,15 +13,75 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterNumber,
                        QgsProcessingParameterExtent,
                        QgsProcessingUtils,
-                       QgsFields, QgsField, QgsFeature,
+                       QgsFields, QgsField, QgsFeature, QgsFeatureRequest,
                        QgsGeometry, QgsPointXY,
                        QgsRasterLayer, QgsCoordinateReferenceSystem,
                        QgsProcessingException)
 import numpy as np
+from scipy.linalg import cho_factor, cho_solve, lstsq
 from osgeo import gdal, osr
 import tempfile
 import os
 
+try:
+    from numba import njit, prange
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+
+try:
+    import numexpr
+    HAS_NUMEXPR = True
+except ImportError:
+    HAS_NUMEXPR = False
+
+
+if HAS_NUMBA:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _fill_trend(raster_data, x0, y0, dx, dy, C):
+        """Evaluate the trend polynomial for every cell, rows in parallel
+
+        Cell (row, col) sits at normalized coordinates (x0 + col * dx, y0 - row * dy);
+        C[i, j] is the coefficient of x**i * y**j.
+        """
+        rows, cols = raster_data.shape
+        degree = C.shape[0] - 1
+
+        for row in prange(rows):
+            y_val = y0 - row * dy
+
+            # y is fixed along the row: Horner in y gives one coefficient per power of x
+            row_coefficients = np.empty(degree + 1)
+            for i in range(degree + 1):
+                acc = C[i, degree - i]
+                for j in range(degree - i - 1, -1, -1):
+                    acc = acc * y_val + C[i, j]
+                row_coefficients[i] = acc
+
+            # Horner in x: degree multiply-adds per cell
+            for col in range(cols):
+                x_val = x0 + col * dx
+                value = row_coefficients[degree]
+                for i in range(degree - 1, -1, -1):
+                    value = value * x_val + row_coefficients[i]
+                raster_data[row, col] = value
+
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _build_design(x, y, degree, out):
+        """Fill the (N, T) design matrix in place, one point per iteration"""
+        for i in prange(x.shape[0]):
+            out[i, 0] = 1.0
+            prev = 0
+            cur = 1
+            for d in range(1, degree + 1):
+                # Degree d terms from degree d - 1: x**(d-j) * y**j is x times the
+                # previous x**(d-1-j) * y**j, and the pure y**d term is y * y**(d-1)
+                for j in range(d):
+                    out[i, cur + j] = out[i, prev + j] * x[i]
+                out[i, cur + d] = out[i, prev + d - 1] * y[i]
+                prev = cur
+                cur += d + 1
+
 
 class TrendSurfaceAlgorithm(QgsProcessingAlgorithm):
     """
@@ -109,43 +169,55 @@ class TrendSurfaceAlgorithm(QgsProcessingAlgorithm):
         if source is None:
             raise QgsProcessingException(self.invalidSourceError(parameters, self.INPUT))
 
-        # Collect points and values
-        points = []
-        z_values = []
+        # Collect points and values straight into coordinate arrays
         total_features = source.featureCount()
+        x = np.empty(max(total_features, 0))
+        y = np.empty_like(x)
+        z = np.empty_like(x)
+        n = 0
+
+        # Only the Z attribute is needed; resolve its index once
+        z_idx = source.fields().indexOf(z_field)
+        request = QgsFeatureRequest().setSubsetOfAttributes([z_idx])
         
         feedback.pushInfo(f"Collecting {total_features} points...")
 
-        for i, feature in enumerate(source.getFeatures()):
-            if feedback.isCanceled():
-                break
-                
+        for i, feature in enumerate(source.getFeatures(request)):
+            # Cancel check and progress go through Qt; poll them every 100 features only
             if i % 100 == 0:
+                if feedback.isCanceled():
+                    break
                 feedback.setProgress(int(i / total_features * 50))
                 
+            # NULL values cannot go into the float arrays; skip those points
+            z_value = feature.attribute(z_idx)
+            if z_value is None:
+                continue
+
             geometry = feature.geometry()
-            if geometry.isMultipart():
-                points.extend([p for p in geometry.asMultiPoint()])
-                z_values.extend([feature[z_field]] * len(geometry.asMultiPoint()))
-            else:
-                point = geometry.asPoint()
-                points.append((point.x(), point.y()))
-                z_values.append(feature[z_field])
-
-        if len(points) < 3:
+            parts = geometry.asMultiPoint() if geometry.isMultipart() else [geometry.asPoint()]
+            for point in parts:
+                if n == len(x):
+                    # Multipart features hold more points than the feature count
+                    x, y, z = (np.resize(a, 2 * n + 1) for a in (x, y, z))
+                x[n] = point.x()
+                y[n] = point.y()
+                z[n] = z_value
+                n += 1
+
+        if n < 3:
             raise QgsProcessingException("Insufficient points to generate trend surface")
 
-        # Convert to numpy arrays
-        x = np.array([p[0] for p in points])
-        y = np.array([p[1] for p in points])
-        z = np.array(z_values)
+        x = x[:n]
+        y = y[:n]
+        z = z[:n]
 
-        feedback.pushInfo(f"Points collected: {len(points)}")
+        feedback.pushInfo(f"Points collected: {n}")
         feedback.pushInfo(f"Fitting polynomial of degree {polynomial_degree}...")
 
         # Fit polynomial trend surface using least squares
         try:
-            coefficients = self.fit_polynomial_surface(x, y, z, polynomial_degree, feedback)
+            coefficients, terms, xc, yc, sx, sy = self.fit_polynomial_surface(x, y, z, polynomial_degree, feedback)
         except Exception as e:
             raise QgsProcessingException(f"Error in polynomial fitting: {str(e)}")
 
@@ -164,9 +236,12 @@ class TrendSurfaceAlgorithm(QgsProcessingAlgorithm):
         feedback.pushInfo(f"Raster dimensions: {cols} x {rows}")
         feedback.pushInfo(f"Extent: X({xmin:.2f}, {xmax:.2f}) Y({ymin:.2f}, {ymax:.2f})")
 
-        # Create raster
+        # Create raster, tiled in 256 x 256 blocks to match the tile writes below
+        block = 256
         driver = gdal.GetDriverByName('GTiff')
-        out_raster = driver.Create(output_path, cols, rows, 1, gdal.GDT_Float32)
+        out_raster = driver.Create(output_path, cols, rows, 1, gdal.GDT_Float32,
+                                   options=['TILED=YES', f'BLOCKXSIZE={block}', f'BLOCKYSIZE={block}',
+                                            'COMPRESS=LZW', 'PREDICTOR=3', 'BIGTIFF=IF_SAFER'])
         
         # Set geotransform
         geotransform = (xmin, cell_size, 0, ymax, 0, -cell_size)
@@ -186,22 +261,37 @@ class TrendSurfaceAlgorithm(QgsProcessingAlgorithm):
         feedback.setProgress(60)
         feedback.pushInfo("Generating trend surface raster...")
 
-        # Calculate values for each cell
-        raster_data = np.zeros((rows, cols), dtype=np.float32)
-        
-        for row in range(rows):
+        # Evaluate and write the raster one file block at a time: each tile is exactly
+        # one 256 x 256 block, so GDAL compresses it straight away without buffering,
+        # and the float64 accumulator of a tile stays cache-resident
+        tile = np.empty((min(block, rows), min(block, cols)), dtype=np.float32)
+
+        # Coefficients laid out once for the evaluators, C[i, j] multiplies x**i * y**j
+        C = self.coefficient_matrix(coefficients, terms)
+
+        # The polynomial is evaluated in the normalized coordinates it was fitted in
+        xs = (xmin + np.arange(cols) * cell_size - xc) / sx
+
+        for row_start in range(0, rows, block):
             if feedback.isCanceled():
                 break
-                
-            if row % 100 == 0:
-                feedback.setProgress(60 + int(row / rows * 35))
-                
-            y_val = ymax - row * cell_size
-            for col in range(cols):
-                x_val = xmin + col * cell_size
-                raster_data[row, col] = self.evaluate_polynomial(x_val, y_val, coefficients, polynomial_degree)
 
-        band.WriteArray(raster_data)
+            rs = min(block, rows - row_start)
+            tile_top = ymax - row_start * cell_size
+            ys = (tile_top - np.arange(rs) * cell_size - yc) / sy
+
+            for col_start in range(0, cols, block):
+                cs = min(block, cols - col_start)
+                if HAS_NUMBA:
+                    _fill_trend(tile[:rs, :cs], xs[col_start], ys[0],
+                                cell_size / sx, cell_size / sy, C)
+                else:
+                    tile[:rs, :cs] = self.evaluate_polynomial_grid(xs[col_start:col_start + cs], ys, C)
+
+                band.WriteArray(tile[:rs, :cs], col_start, row_start)
+
+            feedback.setProgress(60 + int((row_start + rs) / rows * 35))
+
         band.FlushCache()
         
         out_raster = None  # Close file
@@ -212,34 +302,119 @@ class TrendSurfaceAlgorithm(QgsProcessingAlgorithm):
         return {self.OUTPUT: output_path}
 
     def fit_polynomial_surface(self, x, y, z, degree, feedback):
-        """Fit polynomial surface to points using least squares regression"""
-        # Create design matrix
-        A = []
-        for i in range(len(x)):
-            row = []
-            for d in range(degree + 1):
-                for j in range(d + 1):
-                    row.append(x[i] ** (d - j) * y[i] ** j)
-            A.append(row)
-        
-        A = np.array(A)
-        
-        # Solve linear system using least squares
-        coefficients, residuals, rank, s = np.linalg.lstsq(A, z, rcond=None)
-        
-        feedback.pushInfo(f"Fit residuals: {residuals[0]:.4f}" if len(residuals) > 0 else "Fit completed")
+        """Fit polynomial surface to points using least squares regression
+
+        Returns the coefficients with their term exponents and the centering
+        (xc, yc) and scaling (sx, sy) they apply to: the polynomial is in
+        ((x - xc) / sx, (y - yc) / sy).
+        """
+        terms = self.term_exponents(degree)
+
+        # Center and scale the coordinates; raw map coordinates raised to the
+        # polynomial degree make the design matrix hopelessly ill-conditioned
+        xc = x.mean()
+        yc = y.mean()
+        sx = x.std() or 1.0
+        sy = y.std() or 1.0
+        # float32 is enough for the design matrix once the coordinates are normalized
+        # and halves its memory traffic; z stays float64
+        x = ((x - xc) / sx).astype(np.float32)
+        y = ((y - yc) / sy).astype(np.float32)
+
+        # Create design matrix, one column per x**(d-j) * y**j term
+        if HAS_NUMBA:
+            A = np.empty((len(x), len(terms)), dtype=np.float32)
+            _build_design(x, y, degree, A)
+        else:
+            # Per-point power tables; vander builds them by cumulative products instead of pow()
+            xp = np.vander(x, degree + 1, increasing=True)
+            yp = np.vander(y, degree + 1, increasing=True)
+            A = xp[:, terms[:, 0]] * yp[:, terms[:, 1]]
+
+        # Accumulate the normal equations in float64, converting one block of rows at a time
+        n_terms = A.shape[1]
+        AtA = np.zeros((n_terms, n_terms))
+        Atz = np.zeros(n_terms)
+        block_rows = 65536
+        for start in range(0, len(z), block_rows):
+            block = A[start:start + block_rows].astype(np.float64)
+            AtA += block.T @ block
+            Atz += block.T @ z[start:start + block_rows]
+
+        # Scale columns to unit norm; monomial columns span many orders of magnitude.
+        # The norms are the root of the normal matrix diagonal
+        scale = np.sqrt(np.diag(AtA))
+        scale[scale == 0] = 1
+
+        # Solve the normal equations by Cholesky: only a small T x T system for any
+        # number of points
+        try:
+            c, low = cho_factor(AtA / np.outer(scale, scale), check_finite=False)
+            coefficients = cho_solve((c, low), Atz / scale, check_finite=False) / scale
+        except np.linalg.LinAlgError:
+            # Not positive definite (near-collinear terms): fall back to least squares,
+            # by column-pivoted QR (gelsy) rather than NumPy's slower SVD driver
+            coefficients = lstsq(A / scale, z, lapack_driver='gelsy', check_finite=False)[0] / scale
+
+        rss = 0.0
+        for start in range(0, len(z), block_rows):
+            residuals = z[start:start + block_rows] - A[start:start + block_rows].astype(np.float64) @ coefficients
+            rss += np.dot(residuals, residuals)
+        feedback.pushInfo(f"Fit residuals: {rss:.4f}")
         
-        return coefficients
-
-    def evaluate_polynomial(self, x, y, coefficients, degree):
-        """Evaluate polynomial at x, y coordinates"""
-        value = 0
-        idx = 0
-        for d in range(degree + 1):
-            for j in range(d + 1):
-                value += coefficients[idx] * (x ** (d - j)) * (y ** j)
-                idx += 1
-        return value
+        return coefficients, terms, xc, yc, sx, sy
+
+    def term_exponents(self, degree):
+        """Exponents (of x, of y) for each term, in the (d, j) order of the coefficients"""
+        return np.array([(d - j, j) for d in range(degree + 1) for j in range(d + 1)], dtype=np.int8)
+
+    def coefficient_matrix(self, coefficients, terms):
+        """Upper-triangular coefficient matrix, C[i, j] multiplies x**i * y**j"""
+        degree = int(terms.max())
+        C = np.zeros((degree + 1, degree + 1))
+        C[terms[:, 0], terms[:, 1]] = coefficients
+        return C
+
+    def trend_expression(self, C):
+        """Nested Horner form of the fitted polynomial in x and y, with the coefficients as literals"""
+        degree = C.shape[0] - 1
+
+        # Coefficient of x**i as a Horner polynomial in y, then Horner in x over those
+        x_terms = []
+        for i in range(degree + 1):
+            term = repr(float(C[i, degree - i]))
+            for j in range(degree - i - 1, -1, -1):
+                term = f"({term}) * y + ({float(C[i, j])!r})"
+            x_terms.append(term)
+        expression = x_terms[degree]
+        for i in range(degree - 1, -1, -1):
+            expression = f"({expression}) * x + ({x_terms[i]})"
+        return expression
+
+    def evaluate_polynomial_grid(self, xs, ys, C):
+        """Evaluate polynomial on the grid spanned by column coordinates xs and row coordinates ys"""
+        if HAS_NUMEXPR:
+            # One fused, multithreaded pass over the grid for the whole unrolled expression
+            return numexpr.evaluate(self.trend_expression(C),
+                                    local_dict={'x': xs[None, :], 'y': ys[:, None]})
+
+        degree = C.shape[0] - 1
+
+        # Horner in y collapses each power of x into a 1-D coefficient over the rows
+        row_coefficients = []
+        for i in range(degree + 1):
+            acc = np.full(len(ys), C[i, degree - i])
+            for j in range(degree - i - 1, -1, -1):
+                acc = acc * ys + C[i, j]
+            row_coefficients.append(acc)
+
+        # Horner in x over the whole grid, updated in place
+        values = np.empty((len(ys), len(xs)))
+        values[:] = row_coefficients[degree][:, None]
+        for i in range(degree - 1, -1, -1):
+            values *= xs[None, :]
+            values += row_coefficients[i][:, None]
+        return values
 
     def name(self):
         return 'trendsurface'
@@ -18,22 +18,95 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterFolderDestination,
                        QgsProcessingParameterEnum,
                        QgsProcessingUtils,
-                       QgsFields, QgsField, QgsFeature,
+                       QgsFields, QgsField, QgsFeature, QgsFeatureRequest,
                        QgsGeometry, QgsPointXY,
                        QgsRasterLayer, QgsCoordinateReferenceSystem,
                        QgsProcessingException,
                        QgsVectorLayer,
                        QgsProject)
 import numpy as np
+from scipy.linalg import cho_factor, cho_solve, lstsq, solve_triangular
 from osgeo import gdal, osr
 import tempfile
 import os
-import scipy.stats as stats
-from sklearn.metrics import r2_score, mean_squared_error
-from sklearn.model_selection import train_test_split
-import matplotlib.pyplot as plt
-import pandas as pd
 from datetime import datetime
+from math import comb
+
+try:
+    from numba import njit, prange
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+
+
+if HAS_NUMBA:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _design_matrix(x, y, degree):
+        """Polynomial design matrix, points filled in parallel"""
+        n_points = x.shape[0]
+        n_terms = (degree + 1) * (degree + 2) // 2
+        A = np.empty((n_points, n_terms))
+        for i in prange(n_points):
+            A[i, 0] = 1.0
+            prev = 0
+            cur = 1
+            for d in range(1, degree + 1):
+                # Degree d terms from degree d - 1: x**(d-j) * y**j is x times the
+                # previous x**(d-1-j) * y**j, and the pure y**d term is y * y**(d-1)
+                for j in range(d):
+                    A[i, cur + j] = A[i, prev + j] * x[i]
+                A[i, cur + d] = A[i, prev + d - 1] * y[i]
+                prev = cur
+                cur += d + 1
+        return A
+
+    @njit(fastmath=True, cache=True)
+    def _residual_moments(r):
+        """Sum, sum of squares and sum of absolute values of r in a single pass"""
+        s = 0.0
+        ss = 0.0
+        sa = 0.0
+        for v in r:
+            s += v
+            ss += v * v
+            sa += abs(v)
+        return s, ss, sa
+
+
+def _run_fold(test_idx, A, A_weighted, z, z_weighted, AtA, Atz, scale):
+    """Score one cross-validation fold: (mse, r2), None if skipped, or the error message"""
+    # Split data: the training rows are the complement of the test fold
+    train_mask = np.ones(len(z), dtype=bool)
+    train_mask[test_idx] = False
+    train_idx = np.flatnonzero(train_mask)
+
+    if len(train_idx) == 0 or len(test_idx) == 0:
+        return None
+
+    # Train model
+    try:
+        if len(train_idx) < A.shape[1]:
+            return None  # Skip if not enough training data
+
+        # Remove the test fold from the normal equations instead of refitting
+        A_fold = A_weighted[test_idx]
+        AtA_train = AtA - A_fold.T @ A_fold
+        Atz_train = Atz - A_fold.T @ z_weighted[test_idx]
+        try:
+            cho = cho_factor(AtA_train / np.outer(scale, scale))
+            coefficients = cho_solve(cho, Atz_train / scale) / scale
+        except np.linalg.LinAlgError:
+            coefficients = lstsq(A_weighted[train_idx], z_weighted[train_idx],
+                                 lapack_driver='gelsy', check_finite=False)[0]
+
+        # Test model
+        z_pred_test = np.dot(A[test_idx], coefficients)
+
+        # Calculate scores; sklearn is imported on first use, not at Processing startup
+        from sklearn.metrics import r2_score, mean_squared_error
+        return mean_squared_error(z[test_idx], z_pred_test), r2_score(z[test_idx], z_pred_test)
+    except Exception as e:
+        return str(e)
 
 
 class EnhancedTrendSurfaceAlgorithm(QgsProcessingAlgorithm):
@@ -207,17 +280,11 @@ class EnhancedTrendSurfaceAlgorithm(QgsProcessingAlgorithm):
 
         # Collect points and values
         feedback.pushInfo("Collecting data points...")
-        points, z_values, weights = self.collect_data(source, z_field, weight_field, feedback)
+        x, y, z, w = self.collect_data(source, z_field, weight_field, feedback)
 
-        if len(points) < 3:
+        if len(x) < 3:
             raise QgsProcessingException("Insufficient points to generate trend surface")
 
-        # Convert to arrays
-        x = np.array([p[0] for p in points])
-        y = np.array([p[1] for p in points])
-        z = np.array(z_values)
-        w = np.array(weights) if weights else None
-
         feedback.pushInfo(f"Data collected: {len(x)} points")
         feedback.pushInfo(f"Z value range: {np.min(z):.2f} to {np.max(z):.2f}")
 
@@ -252,54 +319,76 @@ class EnhancedTrendSurfaceAlgorithm(QgsProcessingAlgorithm):
         }
 
     def collect_data(self, source, z_field, weight_field, feedback):
-        """Collect points, Z values, and weights"""
-        points = []
-        z_values = []
-        weights = []
-        
+        """Collect X, Y, Z and weights as separate arrays (weights may be None)"""
+        # Written straight into arrays preallocated from the feature count
         total_features = source.featureCount()
+        x = np.empty(max(total_features, 0))
+        y = np.empty_like(x)
+        z = np.empty_like(x)
+        w = np.empty_like(x) if weight_field else None  # NaN marks a missing weight
+        n = 0
+
+        # Only the Z and weight attributes are needed; resolve their indices once
+        fields = source.fields()
+        z_idx = fields.indexOf(z_field)
+        w_idx = fields.indexOf(weight_field) if weight_field else -1
+        attributes = [z_idx] + ([w_idx] if w_idx >= 0 else [])
+        request = QgsFeatureRequest().setSubsetOfAttributes(attributes)
         
-        for i, feature in enumerate(source.getFeatures()):
-            if feedback.isCanceled():
-                break
-                
-            if i % 100 == 0:
-                feedback.setProgress(int(i / total_features * 20))
+        # Feedback is polled about fifty times over the layer, not on every feature
+        progress_step = max(1, total_features // 50)
+        for i, feature in enumerate(source.getFeatures(request)):
+            if i % progress_step == 0:
+                if feedback.isCanceled():
+                    break
+                feedback.setProgress(int(i / max(total_features, 1) * 20))
                 
             geometry = feature.geometry()
-            z_value = feature[z_field]
+            z_value = feature.attribute(z_idx)
             
             if z_value is None or np.isnan(z_value):
                 continue  # Skip null values
                 
-            if geometry.isMultipart():
-                multi_points = geometry.asMultiPoint()
-                for point in multi_points:
-                    points.append((point.x(), point.y()))
-                    z_values.append(z_value)
-                    if weight_field and feature[weight_field] is not None:
-                        weights.append(feature[weight_field])
-            else:
-                point = geometry.asPoint()
-                points.append((point.x(), point.y()))
-                z_values.append(z_value)
-                if weight_field and feature[weight_field] is not None:
-                    weights.append(feature[weight_field])
+            # Read the weight once per feature; the vertex iterator covers single and
+            # multipart points alike, without converting the geometry to a point list
+            weight = feature.attribute(w_idx) if w_idx >= 0 else None
+            for point in geometry.vertices():
+                if n == len(x):
+                    # Multipart features hold more points than the feature count
+                    x, y, z = (np.resize(a, 2 * n + 1) for a in (x, y, z))
+                    if w is not None:
+                        w = np.resize(w, 2 * n + 1)
+                x[n] = point.x()
+                y[n] = point.y()
+                z[n] = z_value
+                if w is not None:
+                    w[n] = weight if weight is not None else np.nan
+                n += 1
+
+        x = x[:n]
+        y = y[:n]
+        z = z[:n]
         
         # If weights were requested but not all features have them, set to None
-        if weight_field and len(weights) != len(points):
-            feedback.pushWarning("Weight field not available for all points. Using unweighted regression.")
-            weights = None
+        if w is not None:
+            w = w[:n]
+            if np.isnan(w).any():
+                feedback.pushWarning("Weight field not available for all points. Using unweighted regression.")
+                w = None
         
-        feedback.pushInfo(f"Successfully collected {len(points)} valid points")
-        return points, z_values, weights
+        feedback.pushInfo(f"Successfully collected {n} valid points")
+        return x, y, z, w
 
     def trend_surface_analysis(self, x, y, z, w, degree, confidence_level, 
                              cross_validation, robust_regression, feedback):
         """Perform comprehensive trend surface analysis"""
         
-        # Create design matrix
-        A = self.create_design_matrix(x, y, degree)
+        # Create design matrix on centered and scaled coordinates; monomials of raw
+        # map coordinates span dozens of orders of magnitude and cancel in every solve
+        xc, yc = np.mean(x), np.mean(y)
+        sx = np.std(x) or 1.0
+        sy = np.std(y) or 1.0
+        A = self.create_design_matrix((x - xc) / sx, (y - yc) / sy, degree)
         feedback.pushInfo(f"Design matrix shape: {A.shape}")
         
         # Check for sufficient data
@@ -310,30 +399,31 @@ class EnhancedTrendSurfaceAlgorithm(QgsProcessingAlgorithm):
                 f"(requires at least {n_features} points)"
             )
 
-        # Fit model
+        # Fit model; the fit returns its predictions along with the residuals
         if robust_regression:
-            coefficients, residuals, model_stats = self.robust_regression_fit(A, z, w, feedback)
+            coefficients, residuals, z_pred, model_stats = self.robust_regression_fit(A, z, w, feedback)
         else:
-            coefficients, residuals, model_stats = self.least_squares_fit(A, z, w, feedback)
-        
-        # Calculate predictions
-        z_pred = np.dot(A, coefficients)
+            coefficients, residuals, z_pred, model_stats = self.least_squares_fit(A, z, w, feedback)
         
         # Cross-validation
         cv_results = None
         if cross_validation and len(z) > 10:
-            cv_results = self.cross_validation(x, y, z, w, degree, feedback)
+            cv_results = self.cross_validation(A, z, w, feedback)
         
         # Confidence intervals
         confidence_intervals = self.calculate_confidence_intervals(
-            A, coefficients, residuals, confidence_level, model_stats, len(z)
+            A, w, coefficients, residuals, confidence_level, model_stats, len(z)
         )
         
         # Comprehensive statistics
         statistics = self.calculate_statistics(z, z_pred, residuals, degree, cv_results)
+        if 'loo_residuals' in confidence_intervals:
+            statistics['loo_rmse'] = np.sqrt(np.mean(confidence_intervals['loo_residuals'] ** 2))
         
         feedback.pushInfo(f"Model R²: {statistics['r2']:.4f}")
         feedback.pushInfo(f"RMSE: {statistics['rmse']:.4f}")
+        if 'loo_rmse' in statistics:
+            feedback.pushInfo(f"Leave-one-out RMSE: {statistics['loo_rmse']:.4f}")
         
         return {
             'coefficients': coefficients,
@@ -344,39 +434,83 @@ class EnhancedTrendSurfaceAlgorithm(QgsProcessingAlgorithm):
             'confidence_intervals': confidence_intervals,
             'statistics': statistics,
             'cv_results': cv_results,
-            'degree': degree
+            'degree': degree,
+            'normalization': (xc, yc, sx, sy)
         }
 
     def create_design_matrix(self, x, y, degree):
         """Create polynomial design matrix with proper dimension handling"""
+        if HAS_NUMBA:
+            return _design_matrix(np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64), degree)
+
         n_points = len(x)
         n_terms = (degree + 1) * (degree + 2) // 2
+
+        # Power tables by recurrence, one multiply per power instead of x ** k per column
+        xp = np.empty((degree + 1, n_points))
+        yp = np.empty((degree + 1, n_points))
+        xp[0] = 1
+        yp[0] = 1
+        for k in range(1, degree + 1):
+            xp[k] = xp[k - 1] * x
+            yp[k] = yp[k - 1] * y
         
-        A = np.ones((n_points, n_terms))
+        A = np.empty((n_points, n_terms))
         
         col_index = 0
         for d in range(degree + 1):
             for j in range(d + 1):
-                if col_index < n_terms:  # Safety check
-                    A[:, col_index] = (x ** (d - j)) * (y ** j)
-                    col_index += 1
+                A[:, col_index] = xp[d - j] * yp[j]
+                col_index += 1
         
         return A
 
     def least_squares_fit(self, A, z, w, feedback):
         """Ordinary least squares fit with proper error handling"""
         try:
-            if w is not None and len(w) == len(z):
-                # Weighted least squares
-                W_sqrt = np.sqrt(w)
-                A_weighted = A * W_sqrt[:, np.newaxis]
-                z_weighted = z * W_sqrt
-                coefficients, residuals, rank, s = np.linalg.lstsq(A_weighted, z_weighted, rcond=None)
-                feedback.pushInfo("Used weighted least squares")
+            weighted = w is not None and len(w) == len(z)
+            if weighted:
+                # Weighted least squares on sqrt(w) A and sqrt(w) z, the same factor
+                # for the normal equations and for the fallback
+                w_sqrt = np.sqrt(w)
+                A_weighted = A * w_sqrt[:, np.newaxis]
+                z_weighted = z * w_sqrt
+                method = "weighted"
             else:
                 # Ordinary least squares
-                coefficients, residuals, rank, s = np.linalg.lstsq(A, z, rcond=None)
-                feedback.pushInfo("Used ordinary least squares")
+                A_weighted = A
+                z_weighted = z
+                method = "ordinary"
+
+            # Normal equations: a small p x p system however many points there are,
+            # solved by Cholesky with the columns scaled to unit norm for conditioning
+            AtA = A_weighted.T @ A_weighted
+            scale = np.sqrt(np.diag(AtA))
+            scale[scale == 0] = 1
+            AtA_scaled = AtA / np.outer(scale, scale)
+            # Eigenvalues of the scaled normal matrix give its condition number and the
+            # singular values of the scaled design matrix in one decomposition
+            eigenvalues = np.clip(np.linalg.eigvalsh(AtA_scaled), 0, None)[::-1]
+            s = np.sqrt(eigenvalues)
+            try:
+                if eigenvalues[-1] <= eigenvalues[0] * 1e-12:
+                    # Squaring the condition number would lose too many digits
+                    raise np.linalg.LinAlgError("Normal matrix is ill-conditioned")
+                cho = cho_factor(AtA_scaled, overwrite_a=True, check_finite=False)
+                coefficients = cho_solve(cho, (A_weighted.T @ z_weighted) / scale, check_finite=False) / scale
+                # Inverse factor from the same Cholesky, reused for the confidence intervals:
+                # A^T W A = (U D)^T (U D), so (A^T W A)^-1 = R_inv R_inv^T, R_inv = D^-1 U^-1
+                R_inv = solve_triangular(cho[0], np.eye(len(scale)), check_finite=False) / scale[:, np.newaxis]
+                rank = int(np.sum(s > s[0] * np.finfo(float).eps * max(A.shape)))
+            except np.linalg.LinAlgError:
+                # Singular or ill-conditioned normal matrix: fall back to least squares on A,
+                # by column-pivoted QR (gelsy), or by SVD (gelsd) if that fails too
+                try:
+                    coefficients, _, rank, _ = lstsq(A_weighted, z_weighted, lapack_driver='gelsy', check_finite=False)
+                except np.linalg.LinAlgError:
+                    coefficients, _, rank, s = lstsq(A_weighted, z_weighted, lapack_driver='gelsd', check_finite=False)
+                R_inv = None
+            feedback.pushInfo(f"Used {method} least squares")
             
             # Calculate residuals properly
             z_pred = np.dot(A, coefficients)
@@ -385,10 +519,11 @@ class EnhancedTrendSurfaceAlgorithm(QgsProcessingAlgorithm):
             model_stats = {
                 'rank': rank,
                 'singular_values': s,
-                'effective_parameters': rank
+                'effective_parameters': rank,
+                'R_inv': R_inv
             }
             
-            return coefficients, residuals, model_stats
+            return coefficients, residuals, z_pred, model_stats
             
         except np.linalg.LinAlgError as e:
             raise QgsProcessingException(f"Matrix solving failed: {str(e)}. Try reducing polynomial degree.")
@@ -400,12 +535,18 @@ class EnhancedTrendSurfaceAlgorithm(QgsProcessingAlgorithm):
         feedback.pushInfo("Starting robust regression...")
         
         # Initial OLS fit
-        coefficients, residuals, model_stats = self.least_squares_fit(A, z, w, feedback)
+        coefficients, residuals, z_pred, model_stats = self.least_squares_fit(A, z, w, feedback)
+
+        # Weighted copy of A, allocated once and overwritten on every iteration
+        WA = np.empty_like(A)
+        prev_weights = None
         
         for iteration in range(max_iter):
             # Calculate robust weights using Huber function
             abs_residuals = np.abs(residuals)
-            mad = np.median(abs_residuals)
+            # Median by selection (linear time) rather than a full sort
+            mid = len(abs_residuals) // 2
+            mad = np.partition(abs_residuals, mid)[mid]
             
             if mad < 1e-10:  # Avoid division by zero
                 break
@@ -417,82 +558,94 @@ class EnhancedTrendSurfaceAlgorithm(QgsProcessingAlgorithm):
             # Update weights considering original weights if provided
             if w is not None:
                 robust_weights = robust_weights * w
+
+            # Weights that no longer move give the same solve again: stop before it
+            if (prev_weights is not None and
+                    np.max(np.abs(robust_weights - prev_weights)) < 1e-4 * robust_weights.max()):
+                feedback.pushInfo(f"Robust regression weights converged after {iteration} iterations")
+                break
+            prev_weights = robust_weights
             
-            # Weighted least squares iteration
-            W_sqrt = np.sqrt(robust_weights)
-            A_weighted = A * W_sqrt[:, np.newaxis]
-            z_weighted = z * W_sqrt
+            # Weighted least squares iteration on the normal equations A^T W A b = (W A)^T z
+            np.multiply(A, robust_weights[:, np.newaxis], out=WA)
+            AtWA = A.T @ WA
+            scale = np.sqrt(np.abs(np.diag(AtWA)))
+            scale[scale == 0] = 1
             
             try:
-                new_coefficients, _, _, _ = np.linalg.lstsq(A_weighted, z_weighted, rcond=None)
+                cho = cho_factor(AtWA / np.outer(scale, scale), overwrite_a=True, check_finite=False)
+                new_coefficients = cho_solve(cho, (WA.T @ z) / scale, check_finite=False) / scale
+            except np.linalg.LinAlgError:
+                W_sqrt = np.sqrt(robust_weights)
+                new_coefficients = lstsq(A * W_sqrt[:, np.newaxis], z * W_sqrt,
+                                         lapack_driver='gelsy', check_finite=False)[0]
             except:
                 break
             
-            # Check convergence
-            coefficient_change = np.max(np.abs(new_coefficients - coefficients))
-            if coefficient_change < tol:
+            # Check convergence, relative to the size of the coefficients
+            coefficient_change = np.linalg.norm(new_coefficients - coefficients)
+            if coefficient_change <= tol * (np.linalg.norm(coefficients) + 1e-30):
                 feedback.pushInfo(f"Robust regression converged after {iteration + 1} iterations")
                 break
                 
             coefficients = new_coefficients
-            residuals = z - np.dot(A, coefficients)
+            # Predictions and residuals updated in place, in the fit's own buffers
+            np.dot(A, coefficients, out=z_pred)
+            np.subtract(z, z_pred, out=residuals)
         
         model_stats['robust_iterations'] = iteration + 1
-        return coefficients, residuals, model_stats
+        return coefficients, residuals, z_pred, model_stats
 
-    def cross_validation(self, x, y, z, w, degree, feedback, k=5):
-        """k-fold cross-validation with proper dimension handling"""
+    def cross_validation(self, A, z, w, feedback, k=5):
+        """k-fold cross-validation on the rows of the model's design matrix A"""
         n = len(z)
         if n < 10:
             feedback.pushWarning("Too few points for cross-validation")
             return None
             
         indices = np.arange(n)
-        np.random.shuffle(indices)
+        np.random.default_rng().shuffle(indices)
+
+        # The fit's design matrix is reused and the normal equations are built once for
+        # all points; each fold only subtracts its own rows' contribution and solves
+        # the small T x T system
+        w_sqrt = np.sqrt(w) if w is not None and len(w) == n else np.ones(n)
+        A_weighted = A * w_sqrt[:, np.newaxis]
+        z_weighted = z * w_sqrt
+        AtA = A_weighted.T @ A_weighted
+        Atz = A_weighted.T @ z_weighted
+        # Unit-norm column scaling keeps the Cholesky factorization well conditioned
+        scale = np.sqrt(np.diag(AtA))
+        scale[scale == 0] = 1
         
-        fold_size = n // k
         mse_scores = []
         r2_scores = []
         
-        for fold in range(min(k, n)):  # Ensure we don't have more folds than points
-            if feedback.isCanceled():
-                break
-                
-            # Split data
-            test_start = fold * fold_size
-            test_end = min(test_start + fold_size, n)
-            
-            if test_start >= n:
-                break
-                
-            test_idx = indices[test_start:test_end]
-            train_idx = np.concatenate([indices[:test_start], indices[test_end:]])
-            
-            if len(train_idx) == 0 or len(test_idx) == 0:
-                continue
-            
-            # Train model
-            try:
-                A_train = self.create_design_matrix(x[train_idx], y[train_idx], degree)
-                if len(train_idx) < A_train.shape[1]:
-                    continue  # Skip if not enough training data
-                    
-                w_train = w[train_idx] if w is not None else None
-                coefficients, _, _ = self.least_squares_fit(A_train, z[train_idx], w_train, feedback)
-                
-                # Test model
-                A_test = self.create_design_matrix(x[test_idx], y[test_idx], degree)
-                z_pred_test = np.dot(A_test, coefficients)
-                
-                # Calculate scores
-                mse = mean_squared_error(z[test_idx], z_pred_test)
-                r2 = r2_score(z[test_idx], z_pred_test)
-                
-                mse_scores.append(mse)
-                r2_scores.append(r2)
-            except Exception as e:
-                feedback.pushWarning(f"Cross-validation fold {fold} failed: {str(e)}")
-                continue
+        # Ensure we don't have more folds than points; array_split spreads the
+        # remainder over the folds, so every point is tested once
+        folds = np.array_split(indices, min(k, n))
+        if feedback.isCanceled():
+            return None
+
+        # Folds are independent and share the read-only arrays above, so with joblib
+        # they run on threads (NumPy and LAPACK release the GIL) without copying
+        # anything; joblib is optional, and without it the folds run in turn
+        try:
+            from joblib import Parallel, delayed
+            results = Parallel(n_jobs=len(folds), prefer='threads')(
+                delayed(_run_fold)(test_idx, A, A_weighted, z, z_weighted, AtA, Atz, scale)
+                for test_idx in folds
+            )
+        except ImportError:
+            results = [_run_fold(test_idx, A, A_weighted, z, z_weighted, AtA, Atz, scale)
+                       for test_idx in folds]
+
+        for fold, result in enumerate(results):
+            if isinstance(result, str):
+                feedback.pushWarning(f"Cross-validation fold {fold} failed: {result}")
+            elif result is not None:
+                mse_scores.append(result[0])
+                r2_scores.append(result[1])
         
         if not mse_scores:
             return None
@@ -505,7 +658,7 @@ class EnhancedTrendSurfaceAlgorithm(QgsProcessingAlgorithm):
             'folds_completed': len(mse_scores)
         }
 
-    def calculate_confidence_intervals(self, A, coefficients, residuals, confidence_level, model_stats, n_samples):
+    def calculate_confidence_intervals(self, A, w, coefficients, residuals, confidence_level, model_stats, n_samples):
         """Calculate confidence intervals for predictions"""
         n = n_samples
         p = len(coefficients)
@@ -518,18 +671,46 @@ class EnhancedTrendSurfaceAlgorithm(QgsProcessingAlgorithm):
                 'confidence_level': confidence_level
             }
         
+        # Everything below is on sqrt(w) A, the matrix the fit factored, so the
+        # covariance is (A^T W A)^-1 on either solve path
+        if w is not None and len(w) == n:
+            w_sqrt = np.sqrt(w)
+            A_weighted = A * w_sqrt[:, np.newaxis]
+            weighted_residuals = residuals * w_sqrt
+        else:
+            A_weighted = A
+            weighted_residuals = residuals
+
         # Residual standard error
-        ss_res = np.sum(residuals**2)
+        ss_res = np.sum(weighted_residuals**2)
         rse = np.sqrt(ss_res / (n - p))
         
-        # Covariance matrix
-        try:
-            cov_matrix = np.linalg.inv(A.T @ A) * (rse**2)
-            std_errors = np.sqrt(np.diag(cov_matrix))
-        except:
-            std_errors = np.ones_like(coefficients) * rse
+        # Inverse triangular factor of the normal matrix, (A^T W A)^-1 = R_inv R_inv^T,
+        # cached by the fit's Cholesky; quadratic forms in the covariance are then
+        # squared norms, which cannot cancel below zero
+        R_inv = model_stats.get('R_inv')
+        if R_inv is None:
+            # The fit fell back from the normal equations, so A^T W A is not formed:
+            # factor sqrt(w) A = Q R over unit-norm columns and invert R
+            scale = np.linalg.norm(A_weighted, axis=0)
+            scale[scale == 0] = 1
+            R = np.linalg.qr(A_weighted / scale, mode='r')
+            try:
+                R_inv = solve_triangular(R, np.eye(p), check_finite=False) / scale[:, np.newaxis]
+            except np.linalg.LinAlgError:
+                # Rank-deficient design: exact zero on the diagonal of R
+                eigenvalues, eigenvectors = np.linalg.eigh(np.linalg.pinv(A_weighted.T @ A_weighted))
+                R_inv = eigenvectors * np.sqrt(np.clip(eigenvalues, 0, None))
+        std_errors = rse * np.sqrt(np.einsum('ij,ij->i', R_inv, R_inv))
+
+        # Leave-one-out residuals e_i / (1 - h_ii) from the leverages, without refitting;
+        # h_ii are the squared row norms of sqrt(w) A R_inv, the rows of Q
+        AR = A_weighted @ R_inv
+        leverage = np.einsum('ij,ij->i', AR, AR)
+        loo_residuals = residuals / np.maximum(1 - leverage, 1e-12)
         
         # t-value for confidence interval
+        from scipy import stats
         try:
             t_value = stats.t.ppf(1 - (1 - confidence_level) / 2, n - p)
         except:
@@ -539,7 +720,9 @@ class EnhancedTrendSurfaceAlgorithm(QgsProcessingAlgorithm):
             'rse': rse,
             'std_errors': std_errors,
             't_value': t_value,
-            'confidence_level': confidence_level
+            'confidence_level': confidence_level,
+            'R_inv': R_inv,
+            'loo_residuals': loo_residuals
         }
 
     def calculate_statistics(self, z_obs, z_pred, residuals, degree, cv_results):
@@ -562,20 +745,27 @@ class EnhancedTrendSurfaceAlgorithm(QgsProcessingAlgorithm):
                 'residual_std': 0
             }
         
-        # Basic statistics
-        ss_res = np.sum(residuals**2)
-        ss_tot = np.sum((z_obs - np.mean(z_obs))**2)
+        # Basic statistics; the residual moments come from one pass over the residuals
+        if HAS_NUMBA:
+            res_sum, ss_res, abs_sum = _residual_moments(np.asarray(residuals, dtype=np.float64))
+        else:
+            res_sum = np.sum(residuals)
+            ss_res = np.dot(residuals, residuals)
+            abs_sum = np.sum(np.abs(residuals))
+        residual_mean = res_sum / n
+        ss_tot = np.var(z_obs) * n
         
         r2 = 1 - (ss_res / ss_tot) if ss_tot > 0 else 0
         r2_adj = 1 - (1 - r2) * (n - 1) / (n - p - 1) if (n - p - 1) > 0 else r2
         rmse = np.sqrt(ss_res / n)
-        mae = np.mean(np.abs(residuals))
+        mae = abs_sum / n
         
         # AIC and BIC
         aic = n * np.log(ss_res / n) + 2 * p if ss_res > 0 else 0
         bic = n * np.log(ss_res / n) + p * np.log(n) if ss_res > 0 else 0
         
         # Normality test
+        from scipy import stats
         try:
             _, normality_p = stats.normaltest(residuals)
         except:
@@ -591,8 +781,8 @@ class EnhancedTrendSurfaceAlgorithm(QgsProcessingAlgorithm):
             'aic': aic,
             'bic': bic,
             'normality_p': normality_p,
-            'residual_mean': np.mean(residuals),
-            'residual_std': np.std(residuals)
+            'residual_mean': residual_mean,
+            'residual_std': np.sqrt(max(ss_res / n - residual_mean ** 2, 0.0))
         }
         
         if cv_results:
@@ -629,27 +819,73 @@ class EnhancedTrendSurfaceAlgorithm(QgsProcessingAlgorithm):
 
         feedback.pushInfo(f"Generating rasters with dimensions: {cols} x {rows}")
 
-        # Create trend surface raster
-        trend_data = np.zeros((rows, cols), dtype=np.float32)
-        confidence_data = np.zeros((rows, cols), dtype=np.float32)
-
         coefficients = results['coefficients']
         degree = results['degree']
         confidence_info = results['confidence_intervals']
+        xc, yc, sx, sy = results['normalization']
+        xs = xmin + np.arange(cols) * cell_size
+        ys = ymax - np.arange(rows) * cell_size
+
+        # Create trend surface raster in float32: each block of rows re-expands the
+        # float64 coefficients around its top-left cell. Row offsets are then local to
+        # the block, while column offsets span the raster width; both are in the fit's
+        # centered and scaled units, a few units across, which keeps the float32 error
+        # near 1e-7 relative. Powers of the column offsets are shared by all blocks,
+        # and each term is an outer product added over a block that stays
+        # cache-resident on large grids
+        feedback.setProgress(50)
+        u = np.arange(cols, dtype=np.float32) * np.float32(cell_size / sx)
+        up = [np.ones_like(u)]
+        for k in range(1, degree + 1):
+            up.append(up[-1] * u)
+
+        # Zeroed, so rows left unevaluated by a cancel are not written as garbage
+        trend_data = np.zeros((rows, cols), dtype=np.float32)
+        block_rows = max(1, min(256, 2 ** 18 // cols))
+        term = np.empty((min(block_rows, rows), cols), dtype=np.float32)
 
-        for row in range(rows):
+        for r0 in range(0, rows, block_rows):
             if feedback.isCanceled():
                 break
-                
-            if row % 100 == 0:
-                feedback.setProgress(50 + int(row / rows * 40))
-                
-            y_val = ymax - row * cell_size
-            for col in range(cols):
-                x_val = xmin + col * cell_size
-                trend_val = self.evaluate_polynomial(x_val, y_val, coefficients, degree)
-                trend_data[row, col] = trend_val
-                confidence_data[row, col] = confidence_info['rse']  # Standard error
+
+            r1 = min(r0 + block_rows, rows)
+            local = self.shift_coefficients(coefficients, degree, (xmin - xc) / sx,
+                                            (ys[r0] - yc) / sy).astype(np.float32)
+            v = np.arange(r1 - r0, dtype=np.float32) * np.float32(-cell_size / sy)
+            vp = [np.ones_like(v)]
+            for k in range(1, degree + 1):
+                vp.append(vp[-1] * v)
+
+            acc = trend_data[r0:r1]
+            tmp = term[:r1 - r0]
+            acc[:] = 0
+            idx = 0
+            for d in range(degree + 1):
+                for j in range(d + 1):
+                    np.multiply.outer(local[idx] * vp[j], up[d - j], out=tmp)
+                    acc += tmp
+                    idx += 1
+
+            feedback.setProgress(50 + int(r1 / rows * 20))
+
+        # The confidence raster is only allocated when it is requested; without the
+        # covariance it is the residual standard error everywhere, a single fill
+        if output_confidence and 'R_inv' in confidence_info:
+            confidence_data = np.zeros((rows, cols), dtype=np.float32)
+            progress_step = max(1, rows // 100)
+            for row in range(rows):
+                if row % progress_step == 0:
+                    if feedback.isCanceled():
+                        break
+                    feedback.setProgress(70 + int(row / rows * 20))
+
+                # Standard error of the fitted surface: rse * sqrt(psi^T (A^T W A)^-1 psi),
+                # the norm of R_inv^T psi, on the coordinates the model was fitted in
+                psi = self.create_design_matrix((xs - xc) / sx, np.full(cols, (ys[row] - yc) / sy), degree)
+                psi_r = psi @ confidence_info['R_inv']
+                confidence_data[row] = confidence_info['rse'] * np.sqrt(np.einsum('ij,ij->i', psi_r, psi_r))
+        elif output_confidence:
+            confidence_data = np.full((rows, cols), confidence_info['rse'], dtype=np.float32)
 
         # Save rasters
         self.save_raster(output_trend, trend_data, xmin, ymax, cell_size, crs, "Trend Surface")
@@ -668,7 +904,11 @@ class EnhancedTrendSurfaceAlgorithm(QgsProcessingAlgorithm):
         driver = gdal.GetDriverByName('GTiff')
         rows, cols = data.shape
         
-        out_raster = driver.Create(path, cols, rows, 1, gdal.GDT_Float32)
+        # Tiled and compressed: the floating-point predictor suits smooth surfaces
+        out_raster = driver.Create(path, cols, rows, 1, gdal.GDT_Float32,
+                                   options=['TILED=YES', 'BLOCKXSIZE=256', 'BLOCKYSIZE=256',
+                                            'COMPRESS=LZW', 'PREDICTOR=3', 'NUM_THREADS=ALL_CPUS',
+                                            'BIGTIFF=IF_SAFER'])
         out_raster.SetGeoTransform((xmin, cell_size, 0, ymax, 0, -cell_size))
         
         if crs.isValid():
@@ -680,19 +920,28 @@ class EnhancedTrendSurfaceAlgorithm(QgsProcessingAlgorithm):
         band.WriteArray(data)
         band.SetNoDataValue(-9999)
         band.SetDescription(description)
-        band.FlushCache()
-        out_raster = None
+        band = None
+        out_raster = None  # Closing the dataset flushes and writes the file
 
-    def evaluate_polynomial(self, x, y, coefficients, degree):
-        """Evaluate polynomial at given coordinates"""
-        value = 0
+    def shift_coefficients(self, coefficients, degree, x0, y0):
+        """Coefficients of the same polynomial in local coordinates (x - x0, y - y0)"""
+        index = {}
         idx = 0
         for d in range(degree + 1):
             for j in range(d + 1):
-                if idx < len(coefficients):  # Safety check
-                    value += coefficients[idx] * (x ** (d - j)) * (y ** j)
-                    idx += 1
-        return value
+                index[d - j, j] = idx
+                idx += 1
+
+        local = np.zeros(len(index))
+        for (i, j), idx in index.items():
+            if idx >= len(coefficients):
+                continue
+            # Binomial expansion of (u + x0)^i * (v + y0)^j
+            for a in range(i + 1):
+                for b in range(j + 1):
+                    local[index[a, b]] += (coefficients[idx] * comb(i, a) * comb(j, b)
+                                           * x0 ** (i - a) * y0 ** (j - b))
+        return local
 
     def create_residual_points_layer(self, source, residuals, z_field, context):
         """Create a point layer with residuals"""
@@ -707,30 +956,28 @@ class EnhancedTrendSurfaceAlgorithm(QgsProcessingAlgorithm):
         provider.addAttributes(fields)
         residual_layer.updateFields()
         
-        # Add features with residuals
-        features = []
-        source_features = list(source.getFeatures())
+        # Add features with residuals, streamed from the source and handed to the
+        # provider in batches
+        z_idx = source.fields().indexOf(z_field)
+        batch = []
+        batch_size = 5000
         
-        for i, (feature, residual) in enumerate(zip(source_features, residuals)):
-            if i >= len(residuals):
-                break
-                
+        for feature, residual in zip(source.getFeatures(), residuals):
             new_feature = QgsFeature(residual_layer.fields())
             new_feature.setGeometry(feature.geometry())
             
-            # Copy attributes
-            for j in range(source.fields().count()):
-                if j < len(feature.attributes()):
-                    new_feature.setAttribute(j, feature.attributes()[j])
-            
-            # Add residual and predicted values
-            z_value = feature[z_field] if feature[z_field] is not None else 0
-            new_feature.setAttribute(source.fields().count(), float(residual))
-            new_feature.setAttribute(source.fields().count() + 1, float(z_value - residual))
+            # Copy attributes and add residual and predicted values in one call
+            attributes = feature.attributes()
+            z_value = attributes[z_idx] if attributes[z_idx] is not None else 0
+            new_feature.setAttributes(attributes + [float(residual), float(z_value - residual)])
             
-            features.append(new_feature)
+            batch.append(new_feature)
+            if len(batch) >= batch_size:
+                provider.addFeatures(batch)
+                batch.clear()
         
-        provider.addFeatures(features)
+        if batch:
+            provider.addFeatures(batch)
         residual_layer.updateExtents()
         
         return residual_layer
@@ -766,6 +1013,8 @@ class EnhancedTrendSurfaceAlgorithm(QgsProcessingAlgorithm):
                 f.write(f"Residual Mean: {stats['residual_mean']:.6f}\n")
                 f.write(f"Residual Std: {stats['residual_std']:.4f}\n")
                 f.write(f"Normality Test p-value: {stats['normality_p']:.4f}\n")
+                if 'loo_rmse' in stats:
+                    f.write(f"Leave-one-out RMSE: {stats['loo_rmse']:.4f}\n")
                 
                 if 'cv_r2' in stats:
                     f.write("\nCROSS-VALIDATION RESULTS:\n")
@@ -0,0 +1,50 @@
+"""
+Accuracy of the plugin's trend surface raster at UTM-scale coordinates
+"""
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+pytest.importorskip("qgis.core")
+gdal = pytest.importorskip("osgeo.gdal")
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, "plugin"))
+
+from qgis.core import QgsCoordinateReferenceSystem  # noqa: E402
+from EnhancedTrendSurface.core_analysis import TrendSurfaceAnalyzer, _term_table  # noqa: E402
+
+
+@pytest.mark.parametrize("degree", [6, 7, 8])
+def test_trend_raster_matches_direct_evaluation(tmp_path, degree):
+    # 400 points over a 20 km square near (5e5, 7.5e6), on a surface of about 100
+    rng = np.random.default_rng(0)
+    x = 5e5 + rng.random(400) * 2e4
+    y = 7.5e6 + rng.random(400) * 2e4
+    z = 100 + 5 * np.sin((x - 5e5) / 4e3) * np.cos((y - 7.5e6) / 5e3) + rng.normal(0, 0.1, 400)
+
+    analyzer = TrendSurfaceAnalyzer(lambda message: None)
+    coefficients, residuals, normalization = analyzer.polynomial_regression(x, y, z, degree)
+    result = {'coefficients': coefficients, 'degree': degree, 'normalization': normalization,
+              'x': x, 'y': y}
+
+    path = str(tmp_path / "trend.tif")
+    analyzer.create_trend_surface(result, None, 50.0, QgsCoordinateReferenceSystem(), path)
+
+    dataset = gdal.Open(path)
+    raster = dataset.GetRasterBand(1).ReadAsArray().astype(np.float64)
+    xmin, cell_x, _, ymax, _, cell_y = dataset.GetGeoTransform()
+    dataset = None
+
+    # Direct float64 evaluation of the fitted polynomial at every cell
+    rows, cols = raster.shape
+    X, Y = np.meshgrid(xmin + np.arange(cols) * cell_x, ymax + np.arange(rows) * cell_y)
+    xc, yc, sx, sy = normalization
+    U = (X - xc) / sx
+    V = (Y - yc) / sy
+    x_exp, y_exp = _term_table(degree)
+    expected = sum(c * U ** a * V ** b for c, a, b in zip(coefficients, x_exp, y_exp))
+
+    assert np.abs(raster - expected).max() < 1e-3